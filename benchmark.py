@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import json
+import random
+import resource
+import subprocess
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from embedding_backends import BACKENDS, EMBEDDING_BACKEND
+from metrics import Metrics
+from process_pdfs import (PersonaDocumentAnalyzer, EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_CHARS, MAX_PROCESSING_TIME,
+                          PARSE_WORKERS, TOP_SECTIONS, iter_page_blocks, resident_memory_mb, split_sections)
+from section_extractor import iter_structured_sections
+
+# Vocabulary for synthetic section text
+WORDS = [
+    "graph", "neural", "network", "protein", "ligand", "binding", "dataset", "benchmark",
+    "revenue", "market", "investment", "strategy", "reaction", "kinetics", "mechanism",
+    "catalyst", "analysis", "model", "training", "evaluation", "method", "result",
+    "performance", "accuracy", "forecast", "growth", "laboratory", "exam", "concept"
+]
+
+CONTEXT_TEXT = ("Role: PhD Researcher in Computational Biology. Expertise: Machine Learning, Drug Discovery. "
+                "Focus: Graph Neural Networks Prepare a literature review on methodologies and benchmarks")
+
+BENCHMARK_PERSONA = {
+    "role": "PhD Researcher in Computational Biology",
+    "expertise": ["Machine Learning", "Drug Discovery"],
+    "focus_areas": ["Graph Neural Networks", "Protein-Ligand Interactions"]
+}
+
+BENCHMARK_JOB = "Prepare a literature review on methodologies, datasets and benchmarks for Graph Neural Networks"
+
+# Synthetic page layout (in points)
+PAGE_MARGIN = 50
+LINE_SPACING = 1.4
+WORDS_PER_LINE = 12
+
+def make_synthetic_sections(num_sections, words_per_section=150, seed=0):
+    """Create synthetic sections with random vocabulary"""
+    rng = random.Random(seed)
+    sections = []
+    for i in range(num_sections):
+        sections.append({
+            "document": f"synthetic_{i // 50}.pdf",
+            "section_title": f"{i + 1}. {' '.join(rng.choices(WORDS, k=3)).upper()}",
+            "content": " ".join(rng.choices(WORDS, k=words_per_section)) + " ",
+            "page_numbers": [i // 5 + 1]
+        })
+    return sections
+
+def generate_synthetic_pdf(pdf_path, pages, header_density=3.0, header_font_size=14, body_font_size=9, seed=0,
+                           footer_font_size=None, outline=False, images=False):
+    """Write a PDF of random text with about header_density numbered headers per page and optional footers, outline and images"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    header_count = 0
+    lines_written = 0
+    toc = []
+    picture = None
+    if images:
+        picture = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 600, 600), False)
+        picture.set_rect(picture.irect, (200, 200, 230))
+
+    for page_index in range(pages):
+        page = doc.new_page()
+        if picture is not None:
+            page.insert_image(page.rect, pixmap=picture, overlay=False)
+        if footer_font_size:
+            page.insert_text((page.rect.width / 2, page.rect.height - PAGE_MARGIN / 2), f"Page {page_index + 1}",
+                             fontsize=footer_font_size)
+        y = PAGE_MARGIN
+        lines_per_page = int((page.rect.height - 2 * PAGE_MARGIN) / (body_font_size * LINE_SPACING))
+        lines_per_header = max(1, round(lines_per_page / header_density)) if header_density > 0 else None
+
+        while y < page.rect.height - PAGE_MARGIN:
+            if lines_per_header and lines_written % lines_per_header == 0:
+                header_count += 1
+                text = f"{header_count}. {' '.join(rng.choices(WORDS, k=3)).upper()}"
+                font_size = header_font_size
+                toc.append([1, text, page_index + 1])
+            else:
+                text = " ".join(rng.choices(WORDS, k=WORDS_PER_LINE))
+                font_size = body_font_size
+
+            page.insert_text((PAGE_MARGIN, y + font_size), text, fontsize=font_size)
+            y += font_size * LINE_SPACING
+            lines_written += 1
+
+    if outline:
+        doc.set_toc(toc)
+    doc.save(pdf_path)
+    doc.close()
+
+def generate_corpus(output_dir, docs, pages, header_density=3.0, header_font_size=14, body_font_size=9, seed=0,
+                    footer_font_size=None, outline=False, images=False):
+    """Write synthetic PDFs and an input JSON referencing them, returning the input JSON path"""
+    os.makedirs(output_dir, exist_ok=True)
+
+    pdf_files = []
+    for i in range(docs):
+        pdf_file = f"synthetic_{i + 1}.pdf"
+        generate_synthetic_pdf(os.path.join(output_dir, pdf_file), pages, header_density,
+                               header_font_size, body_font_size, seed + i, footer_font_size, outline, images)
+        pdf_files.append(pdf_file)
+
+    input_json_path = os.path.join(output_dir, "benchmark_input.json")
+    with open(input_json_path, 'w') as f:
+        json.dump({
+            "collection_name": "Benchmark",
+            "pdf_files": pdf_files,
+            "persona": BENCHMARK_PERSONA,
+            "job_to_be_done": BENCHMARK_JOB
+        }, f, indent=2)
+
+    return input_json_path
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB of this process or, with RUSAGE_CHILDREN, of its largest finished child"""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def score_sections_unbatched(analyzer, sections, context_embedding):
+    """Reference implementation: one encode call and norm computation per section"""
+    scores = []
+    for section in sections:
+        section_text = section["section_title"] + ": " + section["content"]
+        section_embedding = analyzer.model.encode([section_text[:EMBEDDING_MAX_CHARS]], 1)[0]
+        similarity = np.dot(section_embedding, context_embedding) / (
+            np.linalg.norm(section_embedding) * np.linalg.norm(context_embedding)
+        )
+        scores.append(float(1 - similarity))
+    return scores
+
+def benchmark_embedding(analyzer, sections):
+    """Compare per-section and batched scoring of the same sections"""
+    context_embedding = analyzer.embed_texts([CONTEXT_TEXT])[0]
+
+    start_time = time.time()
+    unbatched_scores = score_sections_unbatched(analyzer, sections, context_embedding)
+    unbatched_time = time.time() - start_time
+
+    start_time = time.time()
+    batched_results = analyzer.score_sections(sections, context_embedding)
+    batched_time = time.time() - start_time
+
+    # Both paths keep sections in a stable order, so compare by section position
+    unbatched_order = np.argsort(unbatched_scores, kind="stable")
+    position = {id(section["content"]): i for i, section in enumerate(sections)}
+    batched_scores = [None] * len(sections)
+    for result in batched_results:
+        batched_scores[position[id(result["content"])]] = result["importance_rank"]
+    batched_order = [position[id(result["content"])] for result in batched_results]
+
+    return {
+        "sections": len(sections),
+        "unbatched_seconds": round(unbatched_time, 4),
+        "batched_seconds": round(batched_time, 4),
+        "speedup": round(unbatched_time / batched_time, 2) if batched_time else None,
+        "max_score_difference": float(np.max(np.abs(np.subtract(unbatched_scores, batched_scores)))) if sections else 0.0,
+        "top10_identical": list(unbatched_order[:10]) == batched_order[:10]
+    }
+
+def benchmark_backend(baseline, candidate, sections):
+    """Compare the top-10 ranking and speed of an embedding backend against the float32 baseline"""
+    texts = baseline.section_texts(sections)
+    runs = []
+    for analyzer in (baseline, candidate):
+        context_embedding = analyzer.embed_texts([CONTEXT_TEXT])[0]
+        analyzer.embed_texts(texts[:EMBEDDING_BATCH_SIZE])  # Warm up
+        start_time = time.time()
+        scores = analyzer.embed_texts(texts) @ context_embedding
+        runs.append((np.argsort(-scores, kind="stable")[:TOP_SECTIONS].tolist(), scores, time.time() - start_time))
+
+    (baseline_top, baseline_scores, baseline_time), (candidate_top, candidate_scores, candidate_time) = runs
+    return {
+        "sections": len(sections),
+        "baseline_backend": baseline.embedding_backend,
+        "backend": candidate.embedding_backend,
+        "baseline_seconds": round(baseline_time, 4),
+        "backend_seconds": round(candidate_time, 4),
+        "speedup": round(baseline_time / candidate_time, 2) if candidate_time else None,
+        "max_score_difference": float(np.max(np.abs(baseline_scores - candidate_scores))) if sections else 0.0,
+        "top10_overlap": len(set(baseline_top) & set(candidate_top)),
+        "top10_identical": baseline_top == candidate_top
+    }
+
+def benchmark_extractor(pdf_paths):
+    """Compare throughput and section counts of the span heuristic and the structural extractor"""
+    extractors = {
+        "heuristic": lambda pdf_path, stats: split_sections(os.path.basename(pdf_path), iter_page_blocks(pdf_path, stats)),
+        "structure": iter_structured_sections
+    }
+
+    result = {"documents": len(pdf_paths)}
+    for name, extract in extractors.items():
+        stats = {"pdf_open": 0.0, "text_extraction": 0.0, "pages": 0, "truncated": False}
+        start_time = time.time()
+        sections = sum(1 for pdf_path in pdf_paths for _ in extract(pdf_path, stats))
+        seconds = time.time() - start_time
+        result[name] = {
+            "pages": stats["pages"],
+            "sections": sections,
+            "seconds": round(seconds, 4),
+            "pages_per_second": round(stats["pages"] / seconds, 2) if seconds else None
+        }
+    return result
+
+def measure_collection(input_json_path, embedding_backend=EMBEDDING_BACKEND):
+    """Run a collection end to end with a warm model, returning the stage metrics and memory of that run alone"""
+    analyzer = PersonaDocumentAnalyzer(embedding_backend)
+    # Measure the full pipeline rather than cache lookups
+    analyzer.cache = None
+    analyzer.result_cache = None
+    collection = analyzer.read_collection(input_json_path)
+
+    # Load the model up front so its cost is reported separately
+    start_time = time.time()
+    analyzer.embed_texts([collection["context_text"]])
+    model_load_seconds = time.time() - start_time
+
+    metrics_before = analyzer.metrics.snapshot()
+    rss_before = resident_memory_mb()
+    start_time = time.time()
+    output, _ = analyzer.process_collection(input_json_path)
+    end_to_end_seconds = time.time() - start_time
+    run_metrics = Metrics.difference(metrics_before, analyzer.metrics.snapshot())
+
+    return {
+        "model_load_seconds": model_load_seconds,
+        "end_to_end_seconds": end_to_end_seconds,
+        "metrics": run_metrics,
+        # Whatever the time budget cut: a run that only fit by sampling or skipping pages is not within budget
+        "time_budget": output["metadata"].get("time_budget"),
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+        # Parse worker processes are not part of this process's RSS; with one worker parsing runs in a thread
+        "worker_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if PARSE_WORKERS > 1 else None
+    }
+
+def benchmark_pipeline(input_json_path, embedding_backend=EMBEDDING_BACKEND):
+    """Time a collection end to end and per stage in a fresh process, so nothing else adds to its memory"""
+    code = f"import json, benchmark; print(json.dumps(benchmark.measure_collection({input_json_path!r}, {embedding_backend!r})))"
+    completed = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    run = json.loads(completed.stdout.splitlines()[-1])
+
+    # Stage timers of the measured run, summed over parse workers
+    timers = run["metrics"]["timers"]
+    counters = run["metrics"]["counters"]
+    timings = {"model_load": run["model_load_seconds"]}
+    for stage in ("pdf_open", "text_extraction", "section_detection", "embedding", "similarity_scoring",
+                  "subsection_analysis"):
+        timings[stage] = timers.get(stage, {}).get("seconds", 0.0)
+    staged_seconds = sum(seconds for stage, seconds in timings.items() if stage != "model_load")
+
+    end_to_end_seconds = run["end_to_end_seconds"]
+    pages = counters.get("pages_parsed", 0)
+    sections = counters.get("sections_extracted", 0)
+    return {
+        "documents": counters.get("pdfs_parsed", 0),
+        "pages": pages,
+        "sections": sections,
+        "stage_seconds": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "staged_seconds": round(staged_seconds, 4),
+        "end_to_end_seconds": round(end_to_end_seconds, 4),
+        "pages_per_second": round(pages / end_to_end_seconds, 2) if end_to_end_seconds else None,
+        "sections_per_second": round(sections / end_to_end_seconds, 2) if end_to_end_seconds else None,
+        "peak_rss_mb": round(run["peak_rss_mb"], 1),
+        "run_rss_mb": round(max(0.0, run["peak_rss_mb"] - run["rss_before_mb"]), 1),
+        "worker_peak_rss_mb": run["worker_peak_rss_mb"] and round(run["worker_peak_rss_mb"], 1),
+        "max_processing_time": MAX_PROCESSING_TIME,
+        "time_budget": run["time_budget"],
+        "within_budget": end_to_end_seconds <= MAX_PROCESSING_TIME and run["time_budget"] is None
+    }
+
+def print_pipeline_result(result):
+    print(f"Documents: {result['documents']}, pages: {result['pages']}, sections: {result['sections']}")
+    for stage, seconds in result["stage_seconds"].items():
+        print(f"  {stage:<20} {seconds:8.3f} s")
+    print(f"End to end: {result['end_to_end_seconds']:.2f} seconds "
+          f"({result['pages_per_second']} pages/s, {result['sections_per_second']} sections/s)")
+    print(f"Peak RSS: {result['peak_rss_mb']} MB (+{result['run_rss_mb']} MB during the run)")
+    if result["worker_peak_rss_mb"] is not None:
+        print(f"Peak RSS of the largest parse worker: {result['worker_peak_rss_mb']} MB (not included above)")
+    print(f"Within {result['max_processing_time']}s budget: {result['within_budget']}")
+    if result["time_budget"]:
+        print(f"Cut to fit the budget: {', '.join(result['time_budget']['degradations'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Persona-Driven Document Intelligence pipeline")
+    parser.add_argument("--suite", choices=["pipeline", "embedding", "backend", "extractor"], default="pipeline",
+                        help="pipeline: per-stage timings on a synthetic corpus; embedding: batched vs per-section scoring; "
+                             "backend: top-10 agreement of an embedding backend with float32; "
+                             "extractor: span heuristic vs structural section extraction")
+    parser.add_argument("--docs", type=int, default=4, help="Number of synthetic PDFs")
+    parser.add_argument("--pages", type=int, default=50, help="Pages per synthetic PDF")
+    parser.add_argument("--header-density", type=float, default=3.0, help="Section headers per page")
+    parser.add_argument("--header-font-size", type=float, default=14, help="Font size of synthetic headers")
+    parser.add_argument("--body-font-size", type=float, default=9, help="Font size of synthetic body text")
+    parser.add_argument("--footer-font-size", type=float, help="Add a page number footer in this font size")
+    parser.add_argument("--outline", action="store_true", help="Record the synthetic headers in the PDF outline")
+    parser.add_argument("--images", action="store_true", help="Place a picture on every synthetic page")
+    parser.add_argument("--corpus-dir", help="Directory for the synthetic corpus (default: a temporary directory)")
+    parser.add_argument("--sections", type=int, default=500, help="Number of synthetic sections for the embedding suite")
+    parser.add_argument("--pdf", nargs="*", default=[], help="Score sections from these PDFs in the embedding and backend suites")
+    parser.add_argument("--backend", choices=BACKENDS, default=EMBEDDING_BACKEND,
+                        help="Embedding backend to benchmark (compared against 'torch' in the backend suite)")
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--check-budget", action="store_true",
+                        help="Exit with status 1 if the pipeline exceeds MAX_PROCESSING_TIME")
+
+    args = parser.parse_args()
+
+    analyzer = PersonaDocumentAnalyzer(args.backend)
+    # Measure the full pipeline rather than cache lookups
+    analyzer.cache = None
+
+    if args.suite in ("embedding", "backend"):
+        if args.pdf:
+            sections = []
+            for pdf_path in args.pdf:
+                sections.extend(analyzer.extract_sections(pdf_path))
+        else:
+            sections = make_synthetic_sections(args.sections)
+        if args.suite == "embedding":
+            result = benchmark_embedding(analyzer, sections)
+        else:
+            result = benchmark_backend(PersonaDocumentAnalyzer('torch'), analyzer, sections)
+    elif args.suite == "extractor" and args.pdf:
+        result = benchmark_extractor(args.pdf)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            corpus_dir = args.corpus_dir or tmp_dir
+            input_json_path = generate_corpus(corpus_dir, args.docs, args.pages, args.header_density,
+                                              args.header_font_size, args.body_font_size,
+                                              footer_font_size=args.footer_font_size, outline=args.outline,
+                                              images=args.images)
+            if args.suite == "extractor":
+                result = benchmark_extractor(analyzer.read_collection(input_json_path)["pdf_paths"])
+            else:
+                result = benchmark_pipeline(input_json_path, args.backend)
+        result["parameters"] = {
+            "docs": args.docs,
+            "pages": args.pages,
+            "header_density": args.header_density,
+            "header_font_size": args.header_font_size,
+            "body_font_size": args.body_font_size,
+            "footer_font_size": args.footer_font_size,
+            "outline": args.outline,
+            "images": args.images
+        }
+
+    result["suite"] = args.suite
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif args.suite == "embedding":
+        print(f"Sections scored: {result['sections']}")
+        print(f"Per-section encoding: {result['unbatched_seconds']:.2f} seconds")
+        print(f"Batched encoding: {result['batched_seconds']:.2f} seconds")
+        print(f"Speedup: {result['speedup']}x")
+        print(f"Max score difference: {result['max_score_difference']:.2e}")
+        print(f"Top 10 ranking identical: {result['top10_identical']}")
+    elif args.suite == "backend":
+        print(f"Sections scored: {result['sections']}")
+        print(f"{result['baseline_backend']}: {result['baseline_seconds']:.2f} seconds")
+        print(f"{result['backend']}: {result['backend_seconds']:.2f} seconds ({result['speedup']}x)")
+        print(f"Max score difference: {result['max_score_difference']:.2e}")
+        print(f"Top 10 overlap: {result['top10_overlap']}/{TOP_SECTIONS}, identical order: {result['top10_identical']}")
+    elif args.suite == "extractor":
+        for name in ("heuristic", "structure"):
+            print(f"{name:<10} {result[name]['sections']:6d} sections, {result[name]['pages']} pages in "
+                  f"{result[name]['seconds']:.2f} seconds ({result[name]['pages_per_second']} pages/s)")
+    else:
+        print_pipeline_result(result)
+
+    if args.check_budget and args.suite == "pipeline" and not result["within_budget"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import threading
+import logging
+
+import numpy as np
+
+from embedding_cache import file_hash
+from file_cache import write_atomic
+from section_store import SectionStore
+
+logger = logging.getLogger(__name__)
+
+def output_digest(output):
+    """Hash of an output JSON, ignoring when it was produced"""
+    metadata = {key: value for key, value in output["metadata"].items() if key != "processing_timestamp"}
+    payload = json.dumps({**output, "metadata": metadata}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class CollectionStateStore:
+    """On-disk state of previously processed collections, keyed by input JSON path"""
+
+    def __init__(self, state_dir, model_id):
+        self.state_dir = state_dir
+        self.model_id = model_id  # State computed with another embedding model is ignored
+        self.lock = threading.Lock()
+        os.makedirs(state_dir, exist_ok=True)
+
+    def load(self, input_json_path):
+        """Return the stored state of a collection, or None if it was never processed"""
+        key = self._key(input_json_path)
+        try:
+            with open(self._path(key, '.json'), 'r') as f:
+                state = json.load(f)
+            with np.load(self._path(key, '.npz')) as arrays:
+                state["context_embedding"] = arrays["context"]
+                for i, document in enumerate(state["documents"].values()):
+                    document["sections"] = SectionStore.from_dict(document["sections"])
+                    document["embeddings"] = arrays[f"document_{i}"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable state for {input_json_path}: {str(e)}")
+            return None
+
+        if state.get("model") != self.model_id:
+            return None
+        return state
+
+    def save(self, input_json_path, context_text, context_embedding, documents, output):
+        """Store a collection's output with its context and the {pdf_path: [content_hash, sections, embeddings]} it was scored on"""
+        key = self._key(input_json_path)
+        state = {"model": self.model_id, "context_text": context_text, "output": output, "documents": {}}
+        arrays = {"context": np.asarray(context_embedding, dtype=np.float32)}
+        for i, (pdf_path, (content_hash, sections, embeddings)) in enumerate(documents.items()):
+            stat = os.stat(pdf_path)
+            state["documents"][pdf_path] = {
+                "hash": content_hash,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sections": sections.to_dict()
+            }
+            arrays[f"document_{i}"] = np.asarray(embeddings, dtype=np.float32)
+
+        with self.lock:
+            write_atomic(self._path(key, '.npz'), lambda f: np.savez(f, **arrays))
+            write_atomic(self._path(key, '.json'), lambda f: f.write(json.dumps(state).encode('utf-8')))
+
+    @staticmethod
+    def current_hash(pdf_path, previous=None):
+        """Content hash of a PDF, trusting the previous hash, if any, when its size and modification time are unchanged"""
+        stat = os.stat(pdf_path)
+        if (previous is not None and previous["hash"] is not None
+                and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime):
+            return previous["hash"]
+        return file_hash(pdf_path)
+
+    def _key(self, input_json_path):
+        return hashlib.sha256(os.path.realpath(input_json_path).encode('utf-8')).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.state_dir, key + suffix)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Constants
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')  # 'torch', 'torch-int8' or 'onnx'
+EMBEDDING_THREADS = int(os.environ.get('EMBEDDING_THREADS', '0'))  # Intra-op threads; 0 keeps the library default
+ONNX_MODEL_DIR = os.environ.get('ONNX_MODEL_DIR', 'models/all-MiniLM-L6-v2-onnx')  # Exported model and tokenizer
+ONNX_MODEL_FILE = 'model.onnx'
+MAX_SEQ_LENGTH = 256  # Token limit of all-MiniLM-L6-v2, as used by sentence-transformers
+BACKENDS = ('torch', 'torch-int8', 'onnx')
+
+def local_model_path(model_name):
+    """Directory of a sentence-transformers model already on this machine, found without contacting the Hugging Face Hub"""
+    if os.path.isdir(model_name):
+        return model_name
+
+    repo_id = model_name if '/' in model_name else f"sentence-transformers/{model_name}"
+    # sentence-transformers 2.2 keeps downloaded models in its own cache folder
+    torch_home = os.environ.get('TORCH_HOME', os.path.join(os.environ.get('XDG_CACHE_HOME', '~/.cache'), 'torch'))
+    cache_folder = os.environ.get('SENTENCE_TRANSFORMERS_HOME', os.path.join(os.path.expanduser(torch_home), 'sentence_transformers'))
+    model_path = os.path.join(cache_folder, repo_id.replace('/', '_'))
+    if os.path.exists(os.path.join(model_path, 'modules.json')):
+        return model_path
+
+    # Later versions use the Hugging Face Hub cache
+    try:
+        from huggingface_hub import snapshot_download
+        return snapshot_download(repo_id, local_files_only=True)
+    except (ImportError, OSError, ValueError):
+        raise FileNotFoundError(f"Model {model_name} is not available locally; load it once with the torch backend "
+                                f"or pass a local model directory") from None
+
+class SentenceTransformerBackend:
+    """float32 PyTorch sentence transformer, optionally with int8 dynamically quantized linear layers"""
+
+    def __init__(self, model_name, quantize=False, threads=EMBEDDING_THREADS):
+        if quantize:
+            # The quantized model is derived from local model files only
+            model_name = local_model_path(model_name)
+        from sentence_transformers import SentenceTransformer
+
+        if threads or quantize:
+            import torch
+            if threads:
+                torch.set_num_threads(threads)
+
+        self.name = 'torch-int8' if quantize else 'torch'
+        self.model = SentenceTransformer(model_name, device='cpu')
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size):
+        """Encode texts into L2-normalized float32 embeddings"""
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype(np.float32, copy=False)
+
+class OnnxBackend:
+    """ONNX Runtime export of the transformer with mean pooling, loaded from local files only"""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, threads=EMBEDDING_THREADS):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(model_dir, ONNX_MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"No ONNX model at {model_path}; export one with: python embedding_backends.py --export-onnx {model_dir}")
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.name = 'onnx'
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
+
+    def dimension(self):
+        return self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, texts, batch_size):
+        """Encode texts into L2-normalized float32 embeddings"""
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                    max_length=MAX_SEQ_LENGTH, return_tensors='np')
+            inputs = {name: tokens[name].astype(np.int64) for name in tokens if name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            # Mean pooling over real tokens, then normalization, as in the sentence-transformers pipeline
+            mask = tokens['attention_mask'][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embeddings.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+
+        if not embeddings:
+            return np.zeros((0, self.dimension()), dtype=np.float32)
+        return np.concatenate(embeddings).astype(np.float32, copy=False)
+
+def load_backend(model_name, backend=EMBEDDING_BACKEND, threads=EMBEDDING_THREADS):
+    """Create the embedding backend selected by name"""
+    if backend == 'torch':
+        return SentenceTransformerBackend(model_name, threads=threads)
+    if backend == 'torch-int8':
+        return SentenceTransformerBackend(model_name, quantize=True, threads=threads)
+    if backend == 'onnx':
+        return OnnxBackend(threads=threads)
+    raise ValueError(f"Unknown embedding backend: {backend} (expected one of {', '.join(BACKENDS)})")
+
+def export_onnx(model_name, output_dir):
+    """Export the transformer of a sentence-transformers model and its tokenizer to output_dir"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+
+    sample = tokenizer(["An example sentence for tracing"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            os.path.join(output_dir, ONNX_MODEL_FILE),
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+    tokenizer.save_pretrained(output_dir)
+    logger.info(f"Exported {model_name} to {output_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage embedding backends")
+    parser.add_argument("--export-onnx", metavar="DIR", help="Export the embedding model to ONNX in this directory")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Sentence-transformers model name or local path")
+
+    args = parser.parse_args()
+
+    if not args.export_onnx:
+        parser.print_help()
+        sys.exit(1)
+    export_onnx(args.model, args.export_onnx)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import json
+import hashlib
+import logging
+
+import numpy as np
+
+from file_cache import LRUFileCache
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_hash(path):
+    """Compute the SHA-256 hash of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class EmbeddingCache(LRUFileCache):
+    """On-disk cache of extracted sections (<key>.json) and their embeddings (<key>.npy), keyed by PDF content"""
+
+    suffixes = ('.json', '.npy')
+
+    def make_key(self, content_hash, model_name, params):
+        """Build a cache key from the PDF hash, model name and extraction parameters"""
+        payload = json.dumps([content_hash, model_name, params], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return (sections, embeddings) for a key, or None if not cached"""
+        def read():
+            with open(self._path(key, '.json'), 'r') as f:
+                sections = json.load(f)
+            return sections, np.load(self._path(key, '.npy'), mmap_mode='r')
+
+        with self.lock:
+            return self._read(key, read)
+
+    def put(self, key, sections, embeddings):
+        """Store sections and embeddings for a key; old entries are evicted when the index is saved"""
+        with self.lock:
+            self._write(key, {
+                '.json': lambda f: f.write(json.dumps(sections).encode('utf-8')),
+                '.npy': lambda f: np.save(f, np.asarray(embeddings, dtype=np.float32))
+            })
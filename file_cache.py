@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+
+def write_atomic(path, write):
+    """Write a file through write(f) under a temporary name and move it into place, so readers never see it half written"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path against other processes, where the platform supports it"""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+class LRUFileCache:
+    """Directory of cache entries stored as one file per suffix, evicted least recently used first beyond max_bytes"""
+
+    suffixes = ()
+    name = "cache"  # Used in log messages
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+        self.changes = {}  # 'put', 'access' or 'remove' for each key changed since the index was saved
+
+    def _read(self, key, read):
+        """Return read() for an entry, marking it as used, or None if it is missing or unreadable; call with the lock held"""
+        entry = self.index.get(key)
+        if entry is None or self._expired(entry):
+            if entry is not None:
+                logger.info(f"{self.name.capitalize()} entry {key} expired")
+                self._remove(key)
+            return None
+
+        try:
+            value = read()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable {self.name} entry {key}: {str(e)}")
+            self._remove(key)
+            return None
+
+        entry['last_access'] = time.time()
+        self.changes.setdefault(key, 'access')
+        return value
+
+    def _write(self, key, writers):
+        """Write the files of an entry, {suffix: write(f)}, and add it to the index; call with the lock held"""
+        for suffix, write in writers.items():
+            write_atomic(self._path(key, suffix), write)
+
+        now = time.time()
+        size = sum(os.path.getsize(self._path(key, suffix)) for suffix in self.suffixes)
+        self.index[key] = {"size": size, "created": now, "last_access": now}
+        self.changes[key] = 'put'
+
+    def save(self):
+        """Merge the changes since the last save into the index on disk, evict old entries and write it"""
+        with self.lock:
+            if not self.changes:
+                return
+
+            # Other processes sharing the directory merge their changes one at a time
+            with file_lock(os.path.join(self.cache_dir, LOCK_FILE)):
+                index = self._load_index()
+                for key, change in self.changes.items():
+                    if change == 'put':
+                        index[key] = self.index[key]
+                    elif change == 'remove':
+                        index.pop(key, None)
+                    elif key in index:
+                        # Entries another process evicted stay evicted
+                        index[key]['last_access'] = max(index[key]['last_access'], self.index[key]['last_access'])
+                self.index = index
+                self._evict()
+                self._save_index()
+            self.changes = {}
+
+    def _expired(self, entry):
+        return False
+
+    def _evict(self):
+        """Remove expired entries, then least recently used ones until the cache fits within max_bytes"""
+        for key in [key for key, entry in self.index.items() if self._expired(entry)]:
+            self._remove(key)
+
+        total = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['size']
+            self._remove(key)
+            logger.info(f"Evicted {self.name} entry {key}")
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        self.changes[key] = 'remove'
+        for suffix in self.suffixes:
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        write_atomic(os.path.join(self.cache_dir, INDEX_FILE), lambda f: f.write(json.dumps(self.index).encode('utf-8')))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from datetime import datetime
+
+from embedding_cache import file_hash
+from process_pdfs import PersonaDocumentAnalyzer, TOP_SECTIONS, build_context_text, section_result
+from vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# Constants
+INDEX_DIR = os.environ.get('INDEX_DIR', 'index')
+INDEX_BACKEND = os.environ.get('INDEX_BACKEND', 'numpy')  # 'numpy' or 'faiss'
+INDEX_NPROBE = int(os.environ.get('INDEX_NPROBE', '8'))  # Inverted lists searched per query
+INDEX_BATCH_SIZE = 64  # PDFs parsed and written per index segment
+
+class SectionLibrary:
+    """Indexes sections of a growing PDF library and answers persona queries across all of it"""
+
+    def __init__(self, analyzer, index):
+        self.analyzer = analyzer
+        self.index = index
+
+    def add_documents(self, pdf_paths):
+        """Index new or changed PDFs, returning the number of documents indexed with sections"""
+        pending = []
+        for pdf_path in pdf_paths:
+            pdf_path = os.path.realpath(pdf_path)
+            content_hash = file_hash(pdf_path)
+            if self.index.content_hash(pdf_path) == content_hash:
+                logger.info(f"Already indexed: {pdf_path}")
+                continue
+            pending.append((pdf_path, content_hash))
+
+        indexed = 0
+        for start in range(0, len(pending), INDEX_BATCH_SIZE):
+            batch = pending[start:start + INDEX_BATCH_SIZE]
+            documents = self.analyzer.load_documents([pdf_path for pdf_path, _ in batch])
+            indexed += self.index.add([(pdf_path, content_hash, sections.to_sections(), embeddings)
+                                       for (pdf_path, content_hash), (_, sections, embeddings) in zip(batch, documents)])
+
+        return indexed
+
+    def remove_documents(self, pdf_paths):
+        """Delete PDFs from the index, returning the paths that were indexed"""
+        return self.index.remove([os.path.realpath(pdf_path) for pdf_path in pdf_paths])
+
+    def query(self, persona, job_to_be_done, top_k=TOP_SECTIONS):
+        """Return the most relevant sections across the library in the extracted_sections format"""
+        context_embedding = self.analyzer.embed_texts([build_context_text(persona, job_to_be_done)])[0]
+
+        start_time = time.time()
+        hits = self.index.search(context_embedding, top_k)
+        search_time = time.time() - start_time
+        logger.info(f"Searched {len(self.index)} sections in {search_time * 1000:.1f} ms")
+
+        return {
+            "metadata": {
+                "library": self.index.index_dir,
+                "indexed_documents": len(self.index.documents()),
+                "persona": persona,
+                "job_to_be_done": job_to_be_done,
+                "processing_timestamp": datetime.now().isoformat()
+            },
+            "extracted_sections": [section_result(section, float(1 - similarity)) for similarity, section in hits]
+        }
+
+def find_pdfs(paths):
+    """Expand directories into the PDFs they contain"""
+    pdf_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                pdf_paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.pdf'))
+        else:
+            pdf_paths.append(path)
+    return pdf_paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a PDF library and query it by persona")
+    parser.add_argument("--mode", choices=["add", "remove", "query", "stats"], required=True,
+                        help="add/remove PDFs, query the library with an input JSON, or show index statistics")
+    parser.add_argument("paths", nargs="*", help="PDFs or directories to add or remove")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Directory of the persistent index")
+    parser.add_argument("--backend", choices=["numpy", "faiss"], default=INDEX_BACKEND, help="Search backend")
+    parser.add_argument("--nprobe", type=int, default=INDEX_NPROBE, help="Inverted lists searched per query")
+    parser.add_argument("--input", help="Input JSON with persona and job_to_be_done for query mode")
+    parser.add_argument("--top-k", type=int, default=TOP_SECTIONS, help="Number of sections returned by a query")
+    parser.add_argument("--output", help="Write the query result to this JSON file")
+
+    args = parser.parse_args()
+
+    analyzer = PersonaDocumentAnalyzer()
+    index = VectorIndex(args.index_dir, analyzer.model_id, args.backend, args.nprobe)
+    library = SectionLibrary(analyzer, index)
+
+    if args.mode == "add":
+        added = library.add_documents(find_pdfs(args.paths))
+        print(f"Indexed {added} documents; library has {len(index.documents())} documents")
+    elif args.mode == "remove":
+        removed = library.remove_documents(find_pdfs(args.paths))
+        print(f"Removed {len(removed)} documents; library has {len(index.documents())} documents")
+    elif args.mode == "query":
+        if not args.input:
+            parser.error("--input is required in query mode")
+        with open(args.input, 'r') as f:
+            input_data = json.load(f)
+        output = library.query(input_data['persona'], input_data.get('job_to_be_done', ''), args.top_k)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(output, f, indent=2)
+        else:
+            json.dump(output, sys.stdout, indent=2)
+            print()
+    else:
+        print(json.dumps(index.stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'pdf_analyzer'
+
+class Metrics:
+    """Thread-safe stage timers and counters for the analysis pipeline"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = {}  # stage -> {"count", "seconds", "max_seconds"}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block of code under the given stage name"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+    def add_time(self, stage, seconds, count=1):
+        """Record time spent in a stage, e.g. measured in a worker process"""
+        with self.lock:
+            timer = self.timers.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            timer["count"] += count
+            timer["seconds"] += seconds
+            timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        """Copy of the current timers and counters"""
+        with self.lock:
+            return {
+                "timers": {stage: dict(timer) for stage, timer in self.timers.items()},
+                "counters": dict(self.counters)
+            }
+
+    def rate(self, stages, counter, default=None):
+        """Seconds per counted item measured so far for the given stages, or default before any were counted"""
+        snapshot = self.snapshot()
+        count = snapshot["counters"].get(counter, 0)
+        if not count:
+            return default
+        return sum(snapshot["timers"].get(stage, {}).get("seconds", 0.0) for stage in stages) / count
+
+    @staticmethod
+    def difference(before, after):
+        """Timers and counters accumulated between two snapshots"""
+        timers = {}
+        for stage, timer in after["timers"].items():
+            previous = before["timers"].get(stage, {"count": 0, "seconds": 0.0})
+            if timer["count"] > previous["count"]:
+                timers[stage] = {
+                    "count": timer["count"] - previous["count"],
+                    "seconds": round(timer["seconds"] - previous["seconds"], 6)
+                }
+
+        counters = {}
+        for name, value in after["counters"].items():
+            if value != before["counters"].get(name, 0):
+                counters[name] = value - before["counters"].get(name, 0)
+
+        return {"timers": timers, "counters": counters}
+
+    def write_jsonl(self, path, record):
+        """Append one JSON record to a JSON-lines file"""
+        with self.lock:
+            with open(path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+    def write_prometheus(self, path):
+        """Write cumulative metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {METRICS_PREFIX}_stage_seconds_total Time spent in each pipeline stage",
+            f"# TYPE {METRICS_PREFIX}_stage_seconds_total counter"
+        ]
+        for stage, timer in sorted(snapshot["timers"].items()):
+            lines.append(f'{METRICS_PREFIX}_stage_seconds_total{{stage="{stage}"}} {timer["seconds"]:.6f}')
+
+        lines.append(f"# HELP {METRICS_PREFIX}_stage_calls_total Number of times each pipeline stage ran")
+        lines.append(f"# TYPE {METRICS_PREFIX}_stage_calls_total counter")
+        for stage, timer in sorted(snapshot["timers"].items()):
+            lines.append(f'{METRICS_PREFIX}_stage_calls_total{{stage="{stage}"}} {timer["count"]}')
+
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+            lines.append(f"{METRICS_PREFIX}_{name}_total {value}")
+
+        # Replace the file atomically so scrapers never see a partial write
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+@contextmanager
+def profiled(mode, output_dir, name):
+    """Profile a block with cProfile or pyinstrument, writing the report to output_dir"""
+    if not mode:
+        yield
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, f"{name}_{datetime.now().strftime('%Y%m%dT%H%M%S')}")
+
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed; running without profiling")
+            yield
+            return
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(stem + '.html', 'w') as f:
+                f.write(profiler.output_html())
+            logger.info(f"Profile written to: {stem}.html")
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(stem + '.prof')
+        logger.info(f"Profile written to: {stem}.prof")
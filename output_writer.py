@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import json
+import logging
+
+import numpy as np
+
+from file_cache import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Constants
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'pretty')  # 'pretty' (indented) or 'compact'
+OUTPUT_CONTENT = os.environ.get('OUTPUT_CONTENT', 'full')  # Section content: 'full', 'truncate' or 'offsets' into the sidecar
+OUTPUT_CONTENT_CHARS = int(os.environ.get('OUTPUT_CONTENT_CHARS', '500'))  # Content length kept by 'truncate'
+OUTPUT_SIDECAR = os.environ.get('OUTPUT_SIDECAR', '')  # 'npz' writes a binary sidecar next to each output JSON
+OUTPUT_VALIDATE = os.environ.get('OUTPUT_VALIDATE', '') == '1'  # Validate outputs against the output schema
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema', 'output_schema.json')
+CONTENT_MODES = ('full', 'truncate', 'offsets')
+
+class ScoredOutput(dict):
+    """Output JSON of a collection that also carries the arrays it was scored with, written only to the sidecar"""
+
+    def __init__(self, output, arrays=None):
+        super().__init__(output)
+        self.arrays = arrays or {}
+
+class OutputWriter:
+    """Writes output JSON files, streamed to disk, optionally compact, validated and with an NPZ sidecar"""
+
+    def __init__(self, output_dir, output_format=OUTPUT_FORMAT, content=OUTPUT_CONTENT,
+                 content_chars=OUTPUT_CONTENT_CHARS, sidecar=OUTPUT_SIDECAR, validate=OUTPUT_VALIDATE):
+        if content not in CONTENT_MODES:
+            raise ValueError(f"Unknown output content mode: {content} (expected one of {', '.join(CONTENT_MODES)})")
+        if sidecar not in ('', 'npz'):
+            raise ValueError(f"Unknown output sidecar format: {sidecar} (expected npz)")
+
+        self.output_dir = output_dir
+        self.compact = output_format == 'compact'
+        self.content = content
+        self.content_chars = content_chars
+        self.sidecar = sidecar or ('npz' if content == 'offsets' else '')
+        self.validator = load_validator() if validate else None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, collection_name, output):
+        """Write <collection_name>_output.json and its sidecar, returning the path of the JSON file"""
+        stem = os.path.join(self.output_dir, f"{collection_name}_output")
+        document = self.prepare(output)
+        if self.validator is not None:
+            errors = sorted(self.validator.iter_errors(document), key=lambda error: list(error.path))
+            if errors:
+                location = "/".join(str(part) for part in errors[0].path)
+                raise ValueError(f"Output does not match {SCHEMA_PATH} at {location or 'root'}: {errors[0].message}")
+
+        # The sidecar is written first, so a JSON that references it never points at a missing file
+        if self.sidecar:
+            write_atomic(stem + '.npz', lambda f: np.savez(f, **sidecar_arrays(output)))
+        write_atomic(stem + '.json', lambda f: stream_json(document, f, self.compact))
+        return stem + '.json'
+
+    def prepare(self, output):
+        """The JSON document to write for an output, applying the content mode and compact scores"""
+        sections = []
+        offset = 0
+        for section in output["extracted_sections"]:
+            section = dict(section)
+            content = section.get("content")
+            if content is not None and self.content == 'offsets':
+                length = len(content.encode('utf-8'))
+                del section["content"]
+                section["content_offsets"] = [offset, offset + length]
+                offset += length
+            elif content is not None and self.content == 'truncate' and len(content) > self.content_chars:
+                section["content"] = content[:self.content_chars]
+                section["content_length"] = len(content)
+            if self.compact:
+                section["importance_rank"] = compact_score(section["importance_rank"])
+            sections.append(section)
+
+        subsections = output["subsection_analysis"]
+        if self.compact:
+            subsections = [dict(subsection, relevance_score=compact_score(subsection["relevance_score"]))
+                           for subsection in subsections]
+
+        return {**output, "extracted_sections": sections, "subsection_analysis": subsections}
+
+def compact_score(score):
+    """Score as the shortest decimal that round-trips its float32 value, the precision it was computed in"""
+    return float(str(np.float32(score)))
+
+def json_default(value):
+    """Encode NumPy scalars and arrays, which the json module rejects"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def stream_json(document, f, compact=False):
+    """Encode a document to a binary file chunk by chunk rather than as one string"""
+    text = io.TextIOWrapper(f, encoding='utf-8')
+    if compact:
+        json.dump(document, text, separators=(',', ':'), default=json_default)
+    else:
+        json.dump(document, text, indent=2, default=json_default)
+    text.flush()
+    text.detach()
+
+def sidecar_arrays(output):
+    """Arrays of the sidecar: ranks, scores, section metadata, UTF-8 content and, if known, embeddings"""
+    sections = output["extracted_sections"]
+    contents = [section.get("content", "").encode('utf-8') for section in sections]
+    arrays = {
+        "importance_ranks": np.array([section["importance_rank"] for section in sections], dtype=np.float32),
+        "documents": np.array([section["document"] for section in sections], dtype=str),
+        "section_titles": np.array([section["section_title"] for section in sections], dtype=str),
+        "page_numbers": np.array([section["page_number"] for section in sections], dtype=np.int32),
+        "content": np.frombuffer(b"".join(contents), dtype=np.uint8),
+        "content_offsets": np.cumsum([0] + [len(content) for content in contents], dtype=np.int64),
+        "relevance_scores": np.array([subsection["relevance_score"] for subsection in output["subsection_analysis"]],
+                                     dtype=np.float32)
+    }
+    for name, array in getattr(output, "arrays", {}).items():
+        arrays[name] = np.asarray(array, dtype=np.float32)
+    return arrays
+
+def load_validator():
+    """JSON schema validator for output documents, or None if jsonschema is not installed"""
+    try:
+        import jsonschema
+    except ImportError:
+        logger.warning("jsonschema is not installed; outputs are not validated")
+        return None
+
+    with open(SCHEMA_PATH, 'r') as f:
+        schema = json.load(f)
+    return jsonschema.Draft7Validator(schema)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from scheduler import (PARSE_SECONDS_PER_PAGE, estimate_page_count, measure_parse_rate, parse_deadlines, plan_parsing,
+                       skip_document, truncate_document)
+from section_extractor import ShardedParse
+from section_store import SectionStore
+
+logger = logging.getLogger(__name__)
+
+# Constants
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '4'))  # Items buffered between pipeline stages
+IO_THREADS = 4  # Threads hashing PDFs for cache lookups and writing outputs
+PARSE_STAGES = ("pdf_open", "text_extraction", "section_detection")
+
+class StreamedDocument:
+    """A PDF whose sections arrive in page-order chunks that are scored as soon as they are embedded"""
+
+    def __init__(self, document, users, budgets, keep):
+        self.document = document  # [cache_key, sections, embeddings]
+        self.users = users  # (collection index, position of the PDF in that collection) pairs
+        self.budgets = budgets  # Time budgets of the collections using the PDF
+        self.keep = keep  # Whether the caller wants the sections and embeddings back
+        self.pending = []  # Parsed chunks waiting to be embedded, in page order
+        self.parsed = False  # Whether the last chunk has been parsed
+        self.finished = False
+        self.scored = 0  # Sections scored so far, the index of the next chunk's first section
+        self.chunks = []
+        self.blocks = []
+
+    def take(self):
+        """Parsed chunks that are not embedded yet"""
+        chunks = self.pending
+        self.pending = []
+        return chunks
+
+    def add(self, analyzer, sections, embeddings, rankings, context_embeddings):
+        """Score an embedded chunk for every collection using the PDF, keeping it only if the whole document is needed"""
+        analyzer.push_scores(rankings, self.users, sections, embeddings, context_embeddings, self.scored)
+        self.scored += len(sections)
+        if self.keep or self.document[0] is not None:
+            self.chunks.append(sections)
+            self.blocks.append(embeddings)
+        else:
+            self.chunks, self.blocks = [], []
+
+    def finish(self, analyzer):
+        """Assemble the document from its chunks if it is cached or returned"""
+        if self.keep or self.document[0] is not None:
+            if len(self.chunks) == 1 and isinstance(self.chunks[0], SectionStore):
+                sections = self.chunks[0]
+            else:
+                sections = SectionStore.from_sections(section for chunk in self.chunks for section in chunk)
+            embeddings = np.concatenate(self.blocks) if self.blocks else np.zeros((0, 0), dtype=np.float32)
+            self.document[1:] = [sections, embeddings]
+            analyzer.cache_document(self.document)
+            if not self.keep:
+                self.document[1:] = [None, None]
+        self.chunks, self.blocks = [], []
+
+class CollectionPipeline:
+    """Runs collections through overlapping read, parse, embed, rank and write stages connected by bounded queues"""
+
+    def __init__(self, analyzer, parse, workers, shard_pages=0, queue_size=PIPELINE_QUEUE_SIZE):
+        self.analyzer = analyzer
+        self.parse = parse  # parse(pdf_path, page_indices, deadline, shard) -> (result, stats), run in worker processes
+        self.workers = workers
+        self.shard_pages = shard_pages  # Longer PDFs are parsed as page-range shards; 0 disables sharding
+        self.queue_size = queue_size
+        self.failed = set()  # PDFs whose parsing raised an error, so their missing sections must not be stored
+
+    def run(self, collections, budgets=None, write_output=None, documents=None, context_embeddings=None, pdf_paths=()):
+        """Rank collections, passing each (input_json_path, output, collection_name) to write_output once ready"""
+        return asyncio.run(self.run_async(collections, budgets, write_output, documents, context_embeddings, pdf_paths))
+
+    def load(self, pdf_paths):
+        """Parse and embed PDFs without ranking them, returning [cache_key, sections, embeddings] for each"""
+        documents = {}
+        self.run([], documents=documents, pdf_paths=pdf_paths)
+        return [documents[pdf_path] for pdf_path in pdf_paths]
+
+    async def run_async(self, collections, budgets=None, write_output=None, documents=None, context_embeddings=None,
+                        pdf_paths=()):
+        loop = asyncio.get_running_loop()
+        io_executor = ThreadPoolExecutor(max_workers=IO_THREADS)
+        # Model calls of every run, including concurrent server requests, take turns on the analyzer's model thread
+        model_executor = self.analyzer.model_executor
+        keep = documents is not None
+        documents = documents if keep else {}
+
+        try:
+            # Loading the model and embedding the persona contexts overlaps with reading and parsing PDFs
+            if context_embeddings is None:
+                contexts = loop.run_in_executor(model_executor, self.analyzer.embed_texts,
+                                                [collection["context_text"] for collection in collections])
+            else:
+                contexts = loop.create_future()
+                contexts.set_result(context_embeddings)
+
+            users = {}
+            for i, collection in enumerate(collections):
+                for position, pdf_path in enumerate(collection["pdf_paths"]):
+                    users.setdefault(pdf_path, []).append((i, position))
+
+            unique_paths = list(dict.fromkeys(list(users) + list(pdf_paths)))
+            missing = [pdf_path for pdf_path in unique_paths if pdf_path not in documents]
+            looked_up = await asyncio.gather(*(loop.run_in_executor(io_executor, self.analyzer.lookup_document, pdf_path)
+                                               for pdf_path in missing))
+            documents.update(zip(missing, looked_up))
+
+            pending = [pdf_path for pdf_path in unique_paths if documents[pdf_path][1] is None]
+            page_plans = {}
+            if pending and budgets is not None:
+                pending, page_plans = await loop.run_in_executor(io_executor, self.plan_parsing, collections, pending, budgets)
+                for pdf_path in page_plans:
+                    # Sampled documents are incomplete and must not be cached
+                    documents[pdf_path][0] = None
+            if pending:
+                logger.info(f"Parsing {len(pending)} of {len(unique_paths)} unique PDFs for {len(collections)} collections")
+
+            jobs = deque(await loop.run_in_executor(io_executor, self.plan_shards, pending,
+                                                    [page_plans.get(pdf_path) for pdf_path in pending]))
+            workers = max(1, min(self.workers, len(jobs)))
+            # Runs share the analyzer's parse pool, so only the first one pays for starting the workers
+            parse_executor = self.analyzer.parse_pool(self.workers) if jobs else None
+
+            streams = {}
+            for pdf_path in pending:
+                pdf_users = users.get(pdf_path, [])
+                pdf_budgets = [budgets[i] for i, _ in pdf_users] if budgets is not None else []
+                streams[pdf_path] = StreamedDocument(documents[pdf_path], pdf_users, pdf_budgets, keep)
+            rankings = [self.analyzer.new_ranking() for _ in collections]
+            parsed = asyncio.Queue(self.queue_size)
+            ready = asyncio.Queue(self.queue_size)
+            ranked = asyncio.Queue(self.queue_size)
+            results = [None] * len(collections)
+
+            await asyncio.gather(
+                self.parse_stage(jobs, parsed, streams, parse_executor, workers),
+                self.embed_stage(parsed, ready, collections, documents, users, streams, contexts, rankings, model_executor),
+                self.rank_stage(ready, ranked, collections, contexts, rankings, model_executor, budgets),
+                self.write_stage(ranked, results, io_executor, write_output)
+            )
+            return results
+        except BrokenExecutor:
+            self.analyzer.discard_parse_pool(parse_executor)
+            raise
+        finally:
+            io_executor.shutdown(wait=True)
+            # The cache index is written once per run rather than on every lookup and insert
+            self.analyzer.save_cache()
+
+    async def parse_stage(self, jobs, parsed, streams, executor, workers):
+        """Parse PDFs with one coroutine per worker, queueing each path as soon as sections of it are parsed"""
+        shards = {}  # Stitching state of the sharded PDFs that are not complete yet
+        await asyncio.gather(*(self.parse_worker(jobs, parsed, streams, executor, shards) for _ in range(workers)))
+        await parsed.put(None)
+
+    async def parse_worker(self, jobs, parsed, streams, executor, shards):
+        loop = asyncio.get_running_loop()
+        while jobs:
+            pdf_path, page_indices, shard = jobs.popleft()
+            stream = streams[pdf_path]
+            deadline, report_deadline = parse_deadlines(stream.budgets)
+            result = None
+            if deadline is None or time.time() <= deadline:
+                parsing = loop.run_in_executor(executor, self.parse, pdf_path, page_indices, deadline, shard)
+                try:
+                    # Workers stop at the deadline themselves; allow a short grace period to report back
+                    timeout = max(0.0, report_deadline - time.time()) if report_deadline is not None else None
+                    result = await asyncio.wait_for(parsing, timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            if shard is not None:
+                # Sections of a sharded PDF are handed on as soon as the shards before them are back;
+                # shards that missed the deadline leave gaps
+                sections, stats = self.collect_shard(shards, pdf_path, shard, result)
+            elif result is None:
+                # A PDF that could not be parsed before the deadline contributes no sections
+                skip_document(pdf_path, stream.budgets)
+                stream.document[0] = None
+                sections, stats = SectionStore.from_sections([]), None
+            else:
+                sections, stats = result
+
+            if stats is not None:
+                self.record_parse_stats(stats, pdf_path, stream.budgets)
+                if stats["truncated"] or stats["failed"]:
+                    stream.document[0] = None
+                if stats["failed"]:
+                    self.failed.add(pdf_path)
+            if len(sections):
+                stream.pending.append(sections)
+            stream.parsed = stream.parsed or stats is not None or shard is None
+
+            # Waits while the embedding stage is behind, so parsed sections do not pile up
+            await parsed.put(pdf_path)
+
+    def plan_parsing(self, collections, pending, budgets):
+        """Order the pending PDFs and sample pages of those that would not fit in their collection's budget"""
+        page_counts = {pdf_path: estimate_page_count(pdf_path) for pdf_path in pending}
+        workers = max(1, min(self.workers, len(pending)))
+        seconds_per_page = self.parse_rate(max(pending, key=page_counts.get)) / workers
+        return plan_parsing(collections, pending, budgets, page_counts, seconds_per_page)
+
+    def parse_rate(self, pdf_path):
+        """Seconds per parsed page measured so far or, on a first run, on the first pages of a PDF"""
+        seconds_per_page = self.analyzer.metrics.rate(PARSE_STAGES, "pages_parsed")
+        if seconds_per_page is None:
+            seconds_per_page = measure_parse_rate(pdf_path)
+        return PARSE_SECONDS_PER_PAGE if seconds_per_page is None else seconds_per_page
+
+    def plan_shards(self, pdf_paths, page_plans):
+        """Parse jobs (pdf_path, page_indices, shard), with shard (index, count) for each page-range shard of a long PDF"""
+        jobs = []
+        for pdf_path, page_indices in zip(pdf_paths, page_plans):
+            pages = page_indices
+            shard_count = 1
+            if self.shard_pages > 0:
+                if pages is None:
+                    pages = range(estimate_page_count(pdf_path))
+                shard_count = -(-len(pages) // self.shard_pages)
+
+            if shard_count <= 1:
+                jobs.append((pdf_path, page_indices, None))
+                continue
+
+            # Contiguous shards of nearly equal size, so stitching them in order restores the document
+            bounds = [len(pages) * i // shard_count for i in range(shard_count + 1)]
+            for i in range(shard_count):
+                jobs.append((pdf_path, pages[bounds[i]:bounds[i + 1]], (i, shard_count)))
+
+        return jobs
+
+    def collect_shard(self, shards, pdf_path, shard, result):
+        """Stitch a shard's result onto the shards before it, returning the sections finished so far and, once complete, the PDF's stats"""
+        index, count = shard
+        if pdf_path not in shards:
+            shards[pdf_path] = ShardedParse(pdf_path, count)
+        sections = shards[pdf_path].add(index, result)
+        if not shards[pdf_path].done():
+            return sections, None
+        return sections, shards.pop(pdf_path).stats
+
+    def record_parse_stats(self, stats, pdf_path, budgets):
+        """Add stage timings measured while parsing one PDF to the metrics"""
+        if stats["truncated"]:
+            truncate_document(pdf_path, stats["pages"], budgets)
+
+        metrics = self.analyzer.metrics
+        for stage in PARSE_STAGES:
+            metrics.add_time(stage, stats[stage])
+        metrics.increment("pdfs_parsed")
+        metrics.increment("pages_parsed", stats["pages"])
+        metrics.increment("sections_extracted", stats["sections"])
+
+    async def embed_stage(self, parsed, ready, collections, documents, users, streams, contexts, rankings, executor):
+        """Embed and score parsed sections in batches of whatever has arrived, queueing collections whose PDFs are all scored"""
+        loop = asyncio.get_running_loop()
+        waiting = {i: set(collection["pdf_paths"]) for i, collection in enumerate(collections)}
+
+        async def release(pdf_paths):
+            for i in list(waiting):
+                waiting[i].difference_update(pdf_paths)
+                if not waiting[i]:
+                    del waiting[i]
+                    await ready.put(i)
+
+        # Cached and stored documents are scored right away
+        context_embeddings = await contexts
+        loaded = [pdf_path for pdf_path in users if pdf_path not in streams]
+        await loop.run_in_executor(executor, self.score_loaded, loaded, documents, users, rankings, context_embeddings)
+        await release(loaded)
+
+        finished = False
+        while not finished:
+            batch = [await parsed.get()]
+            while not parsed.empty():
+                batch.append(parsed.get_nowait())
+            finished = None in batch
+
+            chunks = []
+            completed = []
+            for pdf_path in dict.fromkeys(pdf_path for pdf_path in batch if pdf_path is not None):
+                stream = streams[pdf_path]
+                chunks.extend((stream, sections) for sections in stream.take())
+                if stream.parsed and not stream.finished:
+                    # Every chunk of the PDF is in this batch
+                    stream.finished = True
+                    completed.append(pdf_path)
+
+            if chunks or completed:
+                await loop.run_in_executor(executor, self.embed_chunks, chunks, [streams[pdf_path] for pdf_path in completed],
+                                           rankings, context_embeddings)
+                await release(completed)
+
+        await ready.put(None)
+
+    def score_loaded(self, pdf_paths, documents, users, rankings, context_embeddings):
+        for pdf_path in pdf_paths:
+            _, sections, embeddings = documents[pdf_path]
+            self.analyzer.push_scores(rankings, users[pdf_path], sections, embeddings, context_embeddings)
+
+    def embed_chunks(self, chunks, completed, rankings, context_embeddings):
+        """Embed (stream, sections) chunks with one batched encode, score them and finish the completed documents"""
+        budgets = list({id(budget): budget for stream, _ in chunks for budget in stream.budgets}.values())
+        blocks, full = self.analyzer.embed_chunks([sections for _, sections in chunks], budgets)
+        for (stream, sections), embeddings in zip(chunks, blocks):
+            if not full:
+                # Embeddings of truncated text do not match the cache parameters
+                stream.document[0] = None
+            stream.add(self.analyzer, sections, embeddings, rankings, context_embeddings)
+        for stream in completed:
+            stream.finish(self.analyzer)
+
+    async def rank_stage(self, ready, ranked, collections, contexts, rankings, executor, budgets):
+        """Build the output of each collection that is ready from its top sections"""
+        loop = asyncio.get_running_loop()
+        while True:
+            i = await ready.get()
+            if i is None:
+                break
+
+            context_embeddings = await contexts
+            output = await loop.run_in_executor(executor, lambda: self.analyzer.build_output(
+                collections[i], rankings[i].ranked(), context_embeddings[i], budgets and budgets[i]))
+            await ranked.put((i, (collections[i]["input_json_path"], output, collections[i]["collection_name"])))
+
+        await ranked.put(None)
+
+    async def write_stage(self, ranked, results, executor, write_output=None):
+        """Collect ranked results, writing each output while later collections are processed"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await ranked.get()
+            if item is None:
+                break
+
+            i, result = item
+            results[i] = result
+            if write_output is not None:
+                await loop.run_in_executor(executor, write_output, result)
@@ -5,39 +5,589 @@ import json
 import time
 import fitz  # PyMuPDF
 import numpy as np
-import spacy
 from datetime import datetime
-from sentence_transformers import SentenceTransformer
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import heapq
+import threading
 import re
+import bisect
 import logging
+from embedding_cache import EmbeddingCache, file_hash
+from collection_state import CollectionStateStore, output_digest
+from result_cache import ResultCache
+from section_store import SectionStore
+from section_extractor import SectionBuilder, iter_structured_sections, new_parse_stats, open_pdf, structured_shard
+from embedding_backends import EMBEDDING_BACKEND, EMBEDDING_THREADS, load_backend
+from metrics import Metrics, profiled
+from pipeline import CollectionPipeline
+from output_writer import OutputWriter, ScoredOutput
+from scheduler import TimeBudget
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Constants
+APP_VERSION = '1.1.0'  # Bump when a change alters outputs, so cached results of older versions are not served
 MAX_PROCESSING_TIME = 60  # seconds
 INPUT_DIR = os.environ.get('INPUT_DIR', 'input')
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', 'output')
 MODEL_NAME = 'all-MiniLM-L6-v2'  # Small model (<100MB) for sentence embeddings
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '64'))
+EMBEDDING_MAX_CHARS = 1024  # Limit text length for embedding
+HEADER_MIN_FONT_SIZE = 10  # Spans larger than this may start a new section
+PAGE_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+SECTION_EXTRACTOR = os.environ.get('SECTION_EXTRACTOR', 'heuristic')  # 'heuristic' or 'structure' (outline and font statistics)
+CACHE_DIR = os.environ.get('CACHE_DIR', '')  # Empty disables the embedding cache
+CACHE_MAX_MB = int(os.environ.get('CACHE_MAX_MB', '512'))
+SHARD_PAGES = int(os.environ.get('SHARD_PAGES', '100'))  # Longer PDFs are parsed as page-range shards in parallel; 0 disables
+STATE_DIR = os.environ.get('STATE_DIR', '')  # Per-collection state for incremental runs; empty disables them
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '')  # Outputs of repeated queries; empty disables the result cache
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', '64'))
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', '86400'))  # Seconds a cached result is served
+TOP_SECTIONS = 10  # Number of sections written to extracted_sections
+METRICS_FILE = os.environ.get('METRICS_FILE', '')  # JSON-lines file with per-run stage metrics
+METRICS_PROMETHEUS_FILE = os.environ.get('METRICS_PROMETHEUS_FILE', '')  # Prometheus text file with cumulative metrics
+PROFILE_MODE = os.environ.get('PROFILE', '')  # 'cprofile' or 'pyinstrument' to profile collection runs
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Time budget scheduling, as fractions of MAX_PROCESSING_TIME per collection
+EMBED_BUDGET_SHARE = 0.8  # Embedding is planned to use at most this share of the remaining time
+SUBSECTION_RESERVE_SHARE = 0.1  # Subsection analysis is skipped with less time than this left
+EMBED_SECONDS_PER_SECTION = 0.01  # Cost estimate used until real rates have been measured
+MIN_EMBEDDING_CHARS = 256
+
+# Subsection analysis
+TOP_SUBSECTIONS = 15  # Number of chunks written to subsection_analysis
+SUBSECTION_TARGET_CHARS = 400  # Approximate length of a subsection chunk
+SUBSECTION_MIN_CHARS = 50  # Shorter chunks are not considered
+SENTENCE_PATTERN = re.compile(r'\S.*?(?:[.!?](?=\s)|$)', re.DOTALL)
+WORD_PATTERN = re.compile(r'\S+')
+
+def available_cpus():
+    """Number of CPU cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def resident_memory_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Fall back to the peak RSS where /proc is unavailable
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', available_cpus()))  # Processes used for PDF parsing
+
+def iter_page_blocks(pdf_path, stats=None, page_indices=None, deadline=None):
+    """Yield (page_number, blocks) for each page of a PDF, or of page_indices, until deadline passes"""
+    start_time = time.perf_counter()
+    doc = open_pdf(pdf_path)
+    if stats is not None:
+        stats["pdf_open"] += time.perf_counter() - start_time
+    
+    try:
+        for page_num in (range(doc.page_count) if page_indices is None else page_indices):
+            if deadline is not None and time.time() > deadline:
+                if stats is not None:
+                    stats["truncated"] = True
+                break
+            
+            start_time = time.perf_counter()
+            # Image blocks carry no text but would cost their pixel data
+            blocks = doc[page_num].get_text("dict", flags=PAGE_TEXT_FLAGS)["blocks"]
+            if stats is not None:
+                stats["text_extraction"] += time.perf_counter() - start_time
+                stats["pages"] += 1
+            
+            # 1-indexed page numbers
+            yield page_num + 1, blocks
+    finally:
+        doc.close()
+
+def split_sections(pdf_filename, pages, builder=None):
+    """Yield sections from (page_number, blocks) pairs as each following header is detected"""
+    # With a builder given, the section still open at the end is left in it
+    finish = builder is None
+    builder = builder or SectionBuilder(pdf_filename)
+    
+    for page_number, blocks in pages:
+        for block in blocks:
+            if "lines" in block:
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        text = span["text"].strip()
+                        font_size = span["size"]
+                        
+                        # Detect section headers based on font size and formatting
+                        if font_size > HEADER_MIN_FONT_SIZE and (text.isupper() or any(c.isdigit() for c in text)):
+                            # Emit previous section if exists and start a new one
+                            section = builder.start(text, page_number)
+                            if section:
+                                yield section
+                        else:
+                            # Add text to current section; pages only ever increase
+                            builder.add(text, page_number)
+    
+    # Emit the last section
+    section = builder.finish() if finish else None
+    if section:
+        yield section
+
+def iter_sections(pdf_path, stats=None, page_indices=None, deadline=None):
+    """Yield sections of a PDF one at a time with the configured SECTION_EXTRACTOR"""
+    if SECTION_EXTRACTOR == 'structure':
+        return iter_structured_sections(pdf_path, stats, page_indices, deadline)
+    return split_sections(os.path.basename(pdf_path), iter_page_blocks(pdf_path, stats, page_indices, deadline))
+
+def extract_sections(pdf_path):
+    """Split a PDF into sections using font-size based header detection"""
+    return extract_sections_with_stats(pdf_path)[0].to_sections()
+
+def extract_sections_with_stats(pdf_path, page_indices=None, deadline=None):
+    """Extract sections of a PDF, returning (SectionStore, stats) with per-stage timings"""
+    stats = new_parse_stats()
+    start_time = time.perf_counter()
+    try:
+        logger.info(f"Processing PDF: {pdf_path}")
+        sections = SectionStore.from_sections(iter_sections(pdf_path, stats, page_indices, deadline))
+    
+    except Exception as e:
+        logger.error(f"Error processing PDF {pdf_path}: {str(e)}")
+        sections = SectionStore.from_sections([])
+        stats["failed"] = True
+    
+    # Whatever was not spent in PyMuPDF went into splitting spans into sections
+    stats["section_detection"] = time.perf_counter() - start_time - stats["pdf_open"] - stats["text_extraction"]
+    stats["sections"] = len(sections)
+    return sections, stats
+
+def extract_shard_with_stats(pdf_path, page_indices, deadline=None, continued=False):
+    """Extract a page-range shard of a PDF, returning ((sections, open_state, lines), stats) for ShardedParse"""
+    # Leading text of every shard but the first (continued) continues the last section of the shard before it
+    stats = new_parse_stats()
+    start_time = time.perf_counter()
+    try:
+        if SECTION_EXTRACTOR == 'structure':
+            shard = structured_shard(pdf_path, stats, page_indices, deadline, continued)
+        else:
+            builder = SectionBuilder(os.path.basename(pdf_path), continued)
+            pages = iter_page_blocks(pdf_path, stats, page_indices, deadline)
+            shard = (list(split_sections(builder.document, pages, builder)), builder.state(), None)
+    
+    except Exception as e:
+        logger.error(f"Error processing pages of PDF {pdf_path}: {str(e)}")
+        shard = ([], None, None)
+        stats["failed"] = True
+    
+    stats["section_detection"] = time.perf_counter() - start_time - stats["pdf_open"] - stats["text_extraction"]
+    return shard, stats
+
+def extract_job_with_stats(pdf_path, page_indices=None, deadline=None, shard=None):
+    """Parse a whole PDF or, with shard set to (index, count), one of its page-range shards"""
+    if shard is None:
+        return extract_sections_with_stats(pdf_path, page_indices, deadline)
+    return extract_shard_with_stats(pdf_path, page_indices, deadline, continued=shard[0] > 0)
+
+def section_result(section, importance_rank):
+    """Build the output entry for a scored section"""
+    return {
+        "document": section["document"],
+        "page_number": section["page_numbers"][0],  # Use first page of section
+        "section_title": section["section_title"],
+        "importance_rank": importance_rank,  # Lower score = higher importance
+        "content": section["content"],
+        "all_page_numbers": section["page_numbers"]
+    }
+
+def build_context_text(persona, job_to_be_done):
+    """Create the text embedded for a persona and job to be done"""
+    persona_text = f"Role: {persona['role']}. Expertise: {', '.join(persona['expertise'])}. Focus: {', '.join(persona['focus_areas'])}"
+    return persona_text + " " + job_to_be_done
+
+def text_units(content):
+    """Split text into (start, end) spans of sentences, breaking overlong sentences at word boundaries"""
+    units = []
+    for sentence in SENTENCE_PATTERN.finditer(content):
+        if sentence.end() - sentence.start() <= SUBSECTION_TARGET_CHARS:
+            units.append(sentence.span())
+            continue
+        
+        # Overlong sentences are cut into half-window word runs so windows can still overlap
+        start = end = sentence.start()
+        for word in WORD_PATTERN.finditer(content, sentence.start(), sentence.end()):
+            if word.end() - start > SUBSECTION_TARGET_CHARS // 2 and end > start:
+                units.append((start, end))
+                start = word.start()
+            end = word.end()
+        units.append((start, end))
+    return units
+
+def chunk_section(section):
+    """Split a section into half-overlapping windows of sentences, returning (text, page_number) pairs"""
+    content = section["content"]
+    page_numbers = section["page_numbers"]
+    page_offsets = section.get("page_offsets") or [0]
+    units = text_units(content)
+    
+    chunks = []
+    i = 0
+    while i < len(units):
+        # Grow the window until it reaches the target length
+        j = i + 1
+        while j < len(units) and units[j][1] - units[i][0] <= SUBSECTION_TARGET_CHARS:
+            j += 1
+        
+        start, end = units[i][0], units[j - 1][1]
+        page_number = page_numbers[max(0, bisect.bisect_right(page_offsets, start) - 1)]
+        chunks.append((content[start:end], page_number))
+        if j == len(units):
+            break
+        
+        # Slide forward by about half of the window
+        middle = start + (end - start) // 2
+        next_i = i + 1
+        while next_i < j - 1 and units[next_i][0] < middle:
+            next_i += 1
+        i = next_i
+    
+    return chunks
+
+class TopSections:
+    """Running top-k of scored sections, ordered like a stable sort by importance rank"""
+    
+    def __init__(self, k=None):
+        self.k = k
+        self.heap = []  # Worst kept section at the root
+        self.pushed = 0
+    
+    def push(self, sections, similarities, embeddings=None, position=None):
+        """Add sections with their cosine similarities to the context and, optionally, their embeddings"""
+        # Sections are only materialized once they enter the top k; ties go to the earlier position
+        if position is None:
+            position = (0, self.pushed)
+        self.pushed += len(similarities)
+        document, first = position
+        similarities = np.asarray(similarities)
+        candidates = range(len(similarities))
+        if self.k is not None and len(similarities) > self.k:
+            # Only sections at least as similar as the k-th best of this batch can be kept
+            kth = np.partition(similarities, len(similarities) - self.k)[len(similarities) - self.k]
+            candidates = np.flatnonzero(similarities >= kth)
+        
+        for i in candidates:
+            # Earlier sections win ties, so a later section only replaces a strictly worse one
+            key = (-float(1 - similarities[i]), -document, -(first + int(i)))
+            if self.k is None or len(self.heap) < self.k:
+                heapq.heappush(self.heap, key + (sections[i], np.array(embeddings[i]) if embeddings is not None else None))
+            elif key > self.heap[0][:3]:
+                heapq.heapreplace(self.heap, key + (sections[i], np.array(embeddings[i]) if embeddings is not None else None))
+    
+    def ranked(self):
+        """Return (importance_rank, section, embedding) from most to least important"""
+        entries = sorted(self.heap, key=lambda entry: entry[:3], reverse=True)
+        return [(-neg_rank, section, embedding) for neg_rank, _, _, section, embedding in entries]
+    
+    def results(self):
+        """Return result entries from most to least important"""
+        return [section_result(section, importance_rank) for importance_rank, section, _ in self.ranked()]
 
 class PersonaDocumentAnalyzer:
-    def __init__(self):
-        # Load models
-        logger.info("Loading models...")
-        self.nlp = spacy.load('en_core_web_sm')  # Small spaCy model for NLP tasks
-        self.model = SentenceTransformer(MODEL_NAME)  # Sentence transformer for embeddings
-        logger.info("Models loaded successfully")
+    def __init__(self, embedding_backend=EMBEDDING_BACKEND):
+        # Models and their libraries are loaded on first use
+        self._model = None
+        self._nlp = None
+        self.model_lock = threading.Lock()
+        self.embedding_backend = embedding_backend
+        # Pipeline runs embed and rank on this thread, so concurrent runs never use the model at the same time
+        self.model_executor = ThreadPoolExecutor(max_workers=1)
+        # PDFs of every pipeline run are parsed in one pool, started on first use
+        self.parse_executor = None
+        self.parse_executor_lock = threading.Lock()
+        
+        # Stage timers and counters across all runs of this analyzer
+        self.metrics = Metrics()
+        
+        # Reuse sections and embeddings of previously seen PDFs
+        self.cache = EmbeddingCache(CACHE_DIR, CACHE_MAX_MB * 1024 * 1024) if CACHE_DIR else None
+        self.state = CollectionStateStore(STATE_DIR, self.model_id) if STATE_DIR else None
+        self.result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 1024 * 1024, RESULT_CACHE_TTL) if RESULT_CACHE_DIR else None
+        self.content_hashes = {}  # pdf_path -> (size, mtime_ns, content_hash)
         
+    @property
+    def model_id(self):
+        """Identifies the embedding model and backend that stored embeddings were computed with"""
+        if self.embedding_backend == 'torch':
+            return MODEL_NAME
+        return f"{MODEL_NAME}+{self.embedding_backend}"
+    
+
+    @property
+    def model(self):
+        """Embedding backend (see embedding_backends), loaded on first use"""
+        if self._model is None:
+            with self.model_lock:
+                if self._model is None:
+                    start_time = time.time()
+                    logger.info(f"Loading embedding model ({self.embedding_backend} backend)...")
+                    self._model = load_backend(MODEL_NAME, self.embedding_backend, EMBEDDING_THREADS)
+                    logger.info(f"Embedding model loaded in {time.time() - start_time:.2f} seconds "
+                                f"(resident memory {resident_memory_mb():.0f} MB)")
+        return self._model
+    
+    @property
+    def nlp(self):
+        """Small spaCy model for NLP tasks, loaded on first use"""
+        if self._nlp is None:
+            with self.model_lock:
+                if self._nlp is None:
+                    import spacy
+                    self._nlp = spacy.load('en_core_web_sm')
+        return self._nlp
+    
     def process_collection(self, input_json_path):
         """Process a collection of PDFs based on input JSON"""
+        _, output, collection_name = self.pipeline_collections([self.read_collection(input_json_path)])[0]
+        return output, collection_name
+    
+    def process_collections(self, input_json_paths, write_output=None):
+        """Process several collections, extracting and embedding each referenced PDF only once"""
+        return self.pipeline_collections(self.read_collections(input_json_paths), write_output)
+    
+    def pipeline_collections(self, collections, write_output=None):
+        """Rank collections with the asyncio pipeline, overlapping reading, parsing, embedding and output writing"""
+        rank = lambda collections, budgets: self.pipeline().run(collections, budgets, write_output)
+        return self.run_cached(collections, lambda collections: self.run_collections(collections, rank), write_output)
+    
+    def pipeline(self):
+        """Pipeline that parses PDFs in PARSE_WORKERS processes for this analyzer"""
+        return CollectionPipeline(self, extract_job_with_stats, PARSE_WORKERS, SHARD_PAGES)
+    
+    def parse_pool(self, workers):
+        """Executor shared by pipeline runs for parsing; a single parser runs in a thread, sparing a worker process"""
+        with self.parse_executor_lock:
+            if self.parse_executor is None:
+                self.parse_executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+            return self.parse_executor
+    
+    def discard_parse_pool(self, executor):
+        """Drop a broken parse pool so the next run starts a new one"""
+        with self.parse_executor_lock:
+            if self.parse_executor is executor:
+                self.parse_executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def shutdown(self):
+        """Stop the model thread and the parse pool"""
+        self.model_executor.shutdown(wait=True)
+        with self.parse_executor_lock:
+            if self.parse_executor is not None:
+                self.parse_executor.shutdown(wait=True, cancel_futures=True)
+                self.parse_executor = None
+    
+    def read_collections(self, input_json_paths):
+        """Read every input JSON that can be read, logging the others"""
+        collections = []
+        for input_json_path in input_json_paths:
+            try:
+                collections.append(self.read_collection(input_json_path))
+            except Exception as e:
+                logger.error(f"Error reading input file {input_json_path}: {str(e)}")
+        return collections
+    
+    def update_collections(self, collections):
+        """Rank collections against their stored state, returning (input_json_path, output, collection_name, changed)"""
+        return self.run_collections(collections, self.rank_changed_collections)
+    
+    def run_cached(self, collections, run, write_output=None):
+        """Answer collections from the result cache, running run(collections) -> results only for the misses"""
+        if self.result_cache is None:
+            return run(collections)
+        
+        results = [None] * len(collections)
+        misses = []
+        for i, collection in enumerate(collections):
+            key = self.result_key(collection)
+            output = self.result_cache.get(key)
+            if output is None:
+                self.metrics.increment("result_cache_misses")
+                # build_output records the miss in the output metadata
+                misses.append((i, key, dict(collection, result_cache="miss")))
+                continue
+            
+            self.metrics.increment("result_cache_hits")
+            logger.info(f"Using cached result for collection: {collection['collection_name']}")
+            output["metadata"] = dict(self.output_metadata(collection), result_cache="hit")
+            results[i] = (collection["input_json_path"], output, collection["collection_name"])
+            if write_output is not None:
+                write_output(results[i])
+        
+        if misses:
+            for (i, key, _), result in zip(misses, run([collection for _, _, collection in misses])):
+                if "time_budget" not in result[1]["metadata"]:
+                    self.result_cache.put(key, result[1])
+                results[i] = result
+        
+        self.result_cache.save()
+        return results
+    
+    def result_key(self, collection):
+        """Result cache key of a collection: its persona context, PDF contents and names, model, parameters and app version"""
+        documents = [(self.content_hash(pdf_path), os.path.basename(pdf_path)) for pdf_path in collection["pdf_paths"]]
+        params = dict(self.cache_params(), top_sections=TOP_SECTIONS, top_subsections=TOP_SUBSECTIONS,
+                      subsection_target_chars=SUBSECTION_TARGET_CHARS, subsection_min_chars=SUBSECTION_MIN_CHARS)
+        return self.result_cache.make_key(collection["context_text"], documents, self.model_id, params, APP_VERSION)
+    
+    def content_hash(self, pdf_path):
+        """Content hash of a PDF, computed again only when its size or modification time changes"""
+        stat = os.stat(pdf_path)
+        known = self.content_hashes.get(pdf_path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+        content_hash = file_hash(pdf_path)
+        self.content_hashes[pdf_path] = (stat.st_size, stat.st_mtime_ns, content_hash)
+        return content_hash
+    
+    def run_collections(self, collections, rank):
+        """Run a ranking function over collections, each under its own time budget, with profiling and metrics"""
+        if not collections:
+            return []
+        
         start_time = time.time()
+        metrics_before = self.metrics.snapshot()
+        # Each collection gets MAX_PROCESSING_TIME after the time of the collections before it
+        budgets = [TimeBudget(MAX_PROCESSING_TIME, start_time + i * MAX_PROCESSING_TIME) for i in range(len(collections))]
+        
+        with profiled(PROFILE_MODE, PROFILE_DIR, collections[0]["collection_name"]):
+            with self.metrics.timer("collection_run"):
+                results = rank(collections, budgets)
+        
+        # Calculate processing time
+        processing_time = time.time() - start_time
+        logger.info(f"Processing completed in {processing_time:.2f} seconds")
+        
+        self.emit_metrics(collections, processing_time, metrics_before, MAX_PROCESSING_TIME * len(collections))
+        
+        return results
+    
+    def emit_metrics(self, collections, processing_time, metrics_before, budget_seconds):
+        """Log and write the metrics of one run, flagging the slowest stage if over budget"""
+        run_metrics = Metrics.difference(metrics_before, self.metrics.snapshot())
+        stage_seconds = {stage: timer["seconds"] for stage, timer in run_metrics["timers"].items() if stage != "collection_run"}
         
-        # Load input JSON
+        if processing_time > budget_seconds and stage_seconds:
+            slowest = max(stage_seconds, key=stage_seconds.get)
+            logger.warning(f"Processing took {processing_time:.2f} seconds, over the {budget_seconds} second budget; "
+                           f"slowest stage: {slowest} ({stage_seconds[slowest]:.2f} seconds)")
+        
+        if METRICS_FILE:
+            self.metrics.write_jsonl(METRICS_FILE, {
+                "timestamp": datetime.now().isoformat(),
+                "collections": [collection["collection_name"] for collection in collections],
+                "processing_seconds": round(processing_time, 6),
+                "max_processing_time": budget_seconds,
+                **run_metrics
+            })
+        
+        if METRICS_PROMETHEUS_FILE:
+            self.metrics.write_prometheus(METRICS_PROMETHEUS_FILE)
+    
+    def new_ranking(self):
+        """Running top sections of one collection"""
+        return TopSections(TOP_SECTIONS)
+    
+    def push_scores(self, rankings, users, sections, embeddings, context_embeddings, offset=0):
+        """Score a chunk of one PDF's sections, starting at offset, for every (collection index, position) in users"""
+        if not len(sections) or not users:
+            return
+        
+        with self.metrics.timer("similarity_scoring"):
+            similarities = np.asarray(embeddings) @ context_embeddings[[i for i, _ in users]].T
+            for column, (i, position) in enumerate(users):
+                rankings[i].push(sections, similarities[:, column], embeddings, (position, offset))
+        self.metrics.increment("sections_scored", int(similarities.size))
+    
+    def rank_changed_collections(self, collections, budgets=None):
+        """Rank only collections whose PDFs or persona context changed, reusing stored sections and embeddings"""
+        previous = [self.state.load(collection["input_json_path"]) for collection in collections]
+        stored_documents = {}
+        for state in previous:
+            if state is not None:
+                stored_documents.update(state["documents"])
+        
+        # Reuse stored documents whose content did not change; the pipeline loads the others
+        unique_paths = list(dict.fromkeys(pdf_path for collection in collections for pdf_path in collection["pdf_paths"]))
+        hashes = {}
+        documents = {}
+        for pdf_path in unique_paths:
+            stored = stored_documents.get(pdf_path)
+            hashes[pdf_path] = CollectionStateStore.current_hash(pdf_path, stored)
+            if stored is not None and stored["hash"] == hashes[pdf_path]:
+                documents[pdf_path] = [None, stored["sections"], stored["embeddings"]]
+        
+        pending = [pdf_path for pdf_path in unique_paths if pdf_path not in documents]
+        if pending:
+            logger.info(f"Loading {len(pending)} new or changed PDFs")
+        
+        # Reuse context embeddings whose text did not change
+        context_embeddings = [None] * len(collections)
+        new_contexts = []
+        for i, (collection, state) in enumerate(zip(collections, previous)):
+            if state is not None and state["context_text"] == collection["context_text"]:
+                context_embeddings[i] = state["context_embedding"]
+            else:
+                new_contexts.append(i)
+        if new_contexts:
+            embeddings = self.embed_texts([collections[i]["context_text"] for i in new_contexts])
+            for i, embedding in zip(new_contexts, embeddings):
+                context_embeddings[i] = embedding
+        
+        pending = set(pending)
+        changed = [i for i, (collection, state) in enumerate(zip(collections, previous))
+                   if state is None or i in new_contexts
+                   or list(state["documents"]) != collection["pdf_paths"]
+                   or any(pdf_path in pending for pdf_path in collection["pdf_paths"])]
+        
+        results = [None] * len(collections)
+        for i, (collection, state) in enumerate(zip(collections, previous)):
+            if i not in changed:
+                logger.info(f"Collection unchanged: {collection['collection_name']}")
+                results[i] = (collection["input_json_path"], state["output"], collection["collection_name"], False)
+        
+        if changed:
+            # Every PDF of a changed collection that was not stored is new or changed, so the pipeline loads it into documents
+            pipeline = self.pipeline()
+            ranked = pipeline.run([collections[i] for i in changed], budgets and [budgets[i] for i in changed],
+                                         documents=documents,
+                                         context_embeddings=np.stack([context_embeddings[i] for i in changed]))
+            for i, (input_json_path, output, collection_name) in zip(changed, ranked):
+                state = previous[i]
+                modified = state is None or output_digest(state["output"]) != output_digest(output)
+                # Results cut short by the time budget are recomputed on the next run
+                if budgets is None or budgets[i].report() is None:
+                    # PDFs that failed to parse are stored without a hash, so the next run tries them again
+                    self.state.save(input_json_path, collections[i]["context_text"], context_embeddings[i],
+                                    {pdf_path: [None if pdf_path in pipeline.failed else hashes[pdf_path]] + documents[pdf_path][1:]
+                                     for pdf_path in collections[i]["pdf_paths"]}, output)
+                results[i] = (input_json_path, output, collection_name, modified)
+        
+        return results
+    
+    def read_collection(self, input_json_path):
+        """Load an input JSON and resolve the PDFs it references"""
         with open(input_json_path, 'r') as f:
             input_data = json.load(f)
         
+        return self.parse_collection(input_data, os.path.dirname(input_json_path), input_json_path)
+    
+    def parse_collection(self, input_data, pdf_base_dir, input_json_path=None):
+        """Build a collection from input JSON data with PDFs relative to pdf_base_dir"""
         # Extract input parameters
         collection_name = input_data.get('collection_name', 'Unknown')
         pdf_files = input_data.get('pdf_files', [])
@@ -49,174 +599,244 @@ class PersonaDocumentAnalyzer:
         logger.info(f"Persona: {persona['role']}")
         logger.info(f"Job to be done: {job_to_be_done}")
         
-        # Create persona context embedding
-        persona_text = f"Role: {persona['role']}. Expertise: {', '.join(persona['expertise'])}. Focus: {', '.join(persona['focus_areas'])}"
-        job_text = job_to_be_done
-        context_text = persona_text + " " + job_text
-        context_embedding = self.model.encode(context_text)
-        
-        # Process each PDF in parallel
-        pdf_base_dir = os.path.dirname(input_json_path)
-        results = []
-        
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for pdf_file in pdf_files:
-                pdf_path = os.path.join(pdf_base_dir, pdf_file)
-                if os.path.exists(pdf_path):
-                    futures.append(executor.submit(self.process_pdf, pdf_path, context_embedding))
-                else:
-                    logger.warning(f"PDF file not found: {pdf_path}")
-            
-            for future in futures:
-                result = future.result()
-                if result:
-                    results.extend(result)
-        
-        # Sort results by importance rank
-        results.sort(key=lambda x: x['importance_rank'])
-        
-        # Prepare output JSON
-        output = {
-            "metadata": {
-                "input_documents": pdf_files,
-                "persona": persona,
-                "job_to_be_done": job_to_be_done,
-                "processing_timestamp": datetime.now().isoformat()
-            },
-            "extracted_sections": results[:10],  # Top 10 most important sections
-            "subsection_analysis": self.analyze_subsections(results[:5], context_embedding)  # Analyze top 5 sections
+        context_text = build_context_text(persona, job_to_be_done)
+        
+        pdf_paths = []
+        for pdf_file in pdf_files:
+            pdf_path = os.path.join(pdf_base_dir, pdf_file)
+            if os.path.exists(pdf_path):
+                # Resolve paths so collections sharing a PDF share its sections
+                pdf_paths.append(os.path.realpath(pdf_path))
+            else:
+                logger.warning(f"PDF file not found: {pdf_path}")
+        
+        return {
+            "input_json_path": input_json_path,
+            "collection_name": collection_name,
+            "pdf_files": pdf_files,
+            "persona": persona,
+            "job_to_be_done": job_to_be_done,
+            "context_text": context_text,
+            "pdf_paths": pdf_paths
         }
+    
+    def build_output(self, collection, ranked, context_embedding, budget=None):
+        """Prepare the output JSON for a collection from (importance_rank, section, embedding) in rank order"""
+        results = [section_result(section, importance_rank) for importance_rank, section, _ in ranked]
         
-        # Calculate processing time
-        processing_time = time.time() - start_time
-        logger.info(f"Processing completed in {processing_time:.2f} seconds")
+        if budget is not None and budget.remaining() < budget.seconds * SUBSECTION_RESERVE_SHARE:
+            budget.degrade("skipped_subsection_analysis", f"{budget.remaining():.1f}s left")
+            subsection_analysis = []
+        else:
+            # Analyze top 5 sections
+            top_sections = [section for _, section, _ in ranked[:5]]
+            section_embeddings = [embedding for _, _, embedding in ranked[:5]]
+            with self.metrics.timer("subsection_analysis"):
+                subsection_analysis = self.analyze_subsections(top_sections, context_embedding, section_embeddings)
         
-        return output, collection_name
+        # Embeddings of the extracted sections travel with the output for the binary sidecar
+        arrays = {"context_embedding": context_embedding}
+        if ranked and all(embedding is not None for _, _, embedding in ranked):
+            arrays["section_embeddings"] = np.stack([embedding for _, _, embedding in ranked[:TOP_SECTIONS]])
+        
+        output = ScoredOutput({
+            "metadata": self.output_metadata(collection),
+            "extracted_sections": results[:TOP_SECTIONS],  # Top 10 most important sections
+            "subsection_analysis": subsection_analysis
+        }, arrays)
+        
+        # Record what was cut to stay within the time budget
+        report = budget.report() if budget is not None else None
+        if report:
+            output["metadata"]["time_budget"] = report
+        return output
     
-    def process_pdf(self, pdf_path, context_embedding):
-        """Process a single PDF and extract relevant sections"""
-        try:
-            logger.info(f"Processing PDF: {pdf_path}")
-            doc = fitz.open(pdf_path)
-            pdf_filename = os.path.basename(pdf_path)
-            
-            sections = []
-            current_section = None
-            section_text = ""
-            page_numbers = []
-            
-            # Extract sections from PDF
-            for page_num, page in enumerate(doc):
-                # Extract text with layout information
-                blocks = page.get_text("dict")["blocks"]
-                for block in blocks:
-                    if "lines" in block:
-                        for line in block["lines"]:
-                            for span in line["spans"]:
-                                text = span["text"].strip()
-                                font_size = span["size"]
-                                
-                                # Detect section headers based on font size and formatting
-                                if font_size > 10 and (text.isupper() or any(c.isdigit() for c in text)):
-                                    # Save previous section if exists
-                                    if current_section and section_text:
-                                        sections.append({
-                                            "document": pdf_filename,
-                                            "section_title": current_section,
-                                            "content": section_text,
-                                            "page_numbers": page_numbers
-                                        })
-                                    
-                                    # Start new section
-                                    current_section = text
-                                    section_text = ""
-                                    page_numbers = [page_num + 1]  # 1-indexed page numbers
-                                else:
-                                    # Add text to current section
-                                    if current_section:
-                                        section_text += text + " "
-                                        if page_num + 1 not in page_numbers:
-                                            page_numbers.append(page_num + 1)
-            
-            # Add the last section
-            if current_section and section_text:
-                sections.append({
-                    "document": pdf_filename,
-                    "section_title": current_section,
-                    "content": section_text,
-                    "page_numbers": page_numbers
-                })
-            
-            # Calculate relevance scores
-            results = []
-            for i, section in enumerate(sections):
-                # Create embedding for section content
-                section_text = section["section_title"] + ": " + section["content"]
-                section_embedding = self.model.encode(section_text[:1024])  # Limit text length for embedding
-                
-                # Calculate similarity score
-                similarity = np.dot(section_embedding, context_embedding) / (
-                    np.linalg.norm(section_embedding) * np.linalg.norm(context_embedding)
-                )
-                
-                # Create result entry
-                results.append({
-                    "document": section["document"],
-                    "page_number": min(section["page_numbers"]),  # Use first page of section
-                    "section_title": section["section_title"],
-                    "importance_rank": 1 - similarity,  # Lower score = higher importance
-                    "content": section["content"],
-                    "all_page_numbers": section["page_numbers"]
-                })
-            
-            return results
+    def output_metadata(self, collection):
+        """Metadata of a collection's output, stamped with the current time"""
+        metadata = {
+            "input_documents": collection["pdf_files"],
+            "persona": collection["persona"],
+            "job_to_be_done": collection["job_to_be_done"],
+            "processing_timestamp": datetime.now().isoformat()
+        }
+        if "result_cache" in collection:
+            metadata["result_cache"] = collection["result_cache"]
+        return metadata
+    
+    def cache_params(self):
+        """Parameters that affect cached sections and embeddings"""
+        return {
+            "section_format": 3,  # Sections are stored as SectionStore columns
+            "section_extractor": SECTION_EXTRACTOR,
+            "header_min_font_size": HEADER_MIN_FONT_SIZE,
+            "embedding_max_chars": EMBEDDING_MAX_CHARS
+        }
+    
+    def load_documents(self, pdf_paths):
+        """Return [cache_key, sections, embeddings] for each PDF, parsing and embedding cache misses in the pipeline"""
+        return self.pipeline().load(pdf_paths)
+    
+    def lookup_document(self, pdf_path):
+        """Return [cache_key, sections, embeddings] for a PDF, with sections and embeddings None on a cache miss"""
+        if self.cache is None:
+            return [None, None, None]
+        
+        cache_key = self.cache.make_key(self.content_hash(pdf_path), self.model_id, self.cache_params())
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            self.metrics.increment("cache_misses")
+            return [cache_key, None, None]
+        
+        self.metrics.increment("cache_hits")
+        
+        logger.info(f"Using cached sections for PDF: {pdf_path}")
+        sections, embeddings = cached
         
-        except Exception as e:
-            logger.error(f"Error processing PDF {pdf_path}: {str(e)}")
+        # The same content may appear under a different file name
+        sections = SectionStore.from_dict(sections).with_document(os.path.basename(pdf_path))
+        
+        return [cache_key, sections, embeddings]
+    
+    def embed_chunks(self, chunks, budgets=()):
+        """Embed chunks of sections with one batched encode, returning their embeddings and whether texts were embedded in full"""
+        max_chars = EMBEDDING_MAX_CHARS
+        if budgets:
+            max_chars = self.plan_embedding(sum(len(chunk) for chunk in chunks), budgets)
+        
+        embeddings = self.embed_texts([text for chunk in chunks for text in self.section_texts(chunk, max_chars)])
+        blocks = []
+        offset = 0
+        for chunk in chunks:
+            blocks.append(embeddings[offset:offset + len(chunk)])
+            offset += len(chunk)
+        return blocks, max_chars == EMBEDDING_MAX_CHARS
+    
+    def cache_document(self, document):
+        """Store a completely parsed and embedded [cache_key, sections, embeddings] document in the cache"""
+        cache_key, sections, embeddings = document
+        # Sampled, truncated and skipped documents have no cache key
+        if self.cache is not None and cache_key is not None and len(sections):
+            self.cache.put(cache_key, sections.to_dict(), embeddings)
+    
+    def save_cache(self):
+        """Write the cache index with the lookups and inserts since it was last saved"""
+        if self.cache is not None:
+            self.cache.save()
+    
+    def extract_sections(self, pdf_path):
+        """Split a PDF into sections using font-size based header detection"""
+        return extract_sections(pdf_path)
+    
+    def embed_texts(self, texts):
+        """Encode texts in batches into L2-normalized float32 embeddings"""
+        if not texts:
+            return np.zeros((0, self.model.dimension()), dtype=np.float32)
+        
+        model = self.model
+        with self.metrics.timer("embedding"):
+            embeddings = model.encode(texts, EMBEDDING_BATCH_SIZE)
+        self.metrics.increment("embedding_items", len(texts))
+        self.metrics.increment("embedding_batches", -(-len(texts) // EMBEDDING_BATCH_SIZE))
+        return embeddings
+    
+    def plan_embedding(self, num_sections, budgets):
+        """Pick the embedding text length so that encoding fits in the tightest of the remaining budgets"""
+        seconds_per_section = self.metrics.rate(("embedding",), "embedding_items", EMBED_SECONDS_PER_SECTION)
+        estimated_seconds = num_sections * seconds_per_section
+        allowed_seconds = max(0.0, min(budget.remaining() for budget in budgets) * EMBED_BUDGET_SHARE)
+        if estimated_seconds <= allowed_seconds:
+            return EMBEDDING_MAX_CHARS
+        
+        # Encoding cost grows roughly linearly with text length
+        max_chars = max(MIN_EMBEDDING_CHARS, int(EMBEDDING_MAX_CHARS * allowed_seconds / estimated_seconds))
+        for budget in budgets:
+            budget.degrade("reduced_embedding_chars", f"embedding {num_sections} sections truncated to {max_chars} characters")
+        return max_chars
+    
+    def section_texts(self, sections, max_chars=EMBEDDING_MAX_CHARS):
+        """Build the truncated texts used to embed sections"""
+        if isinstance(sections, SectionStore):
+            return sections.texts(max_chars)
+        return [(section["section_title"] + ": " + section["content"])[:max_chars] for section in sections]
+    
+    def score_sections(self, sections, context_embedding):
+        """Score sections against the normalized context embedding in one batch"""
+        return self.rank_sections(sections, [self.embed_texts(self.section_texts(sections))], context_embedding)
+    
+    def rank_sections(self, sections, embeddings, context_embedding, top_k=None):
+        """Turn sections and their embedding blocks into result entries sorted by importance"""
+        if not sections:
             return []
+        
+        # Cosine similarity reduces to a dot product for normalized vectors
+        section_embeddings = np.concatenate([e for e in embeddings if len(e)])
+        top_sections = TopSections(top_k)
+        top_sections.push(sections, section_embeddings @ context_embedding)
+        
+        return top_sections.results()
     
-    def analyze_subsections(self, top_sections, context_embedding):
-        """Analyze subsections within top sections"""
+    def analyze_subsections(self, top_sections, context_embedding, section_embeddings=None):
+        """Score sliding-window chunks of the top sections in one batch and keep the most relevant"""
+        candidates = []
+        texts = []
+        reused = {}
+        for i, section in enumerate(top_sections):
+            chunks = [(text, page_number) for text, page_number in chunk_section(section)
+                      if len(text.strip()) >= SUBSECTION_MIN_CHARS]  # Skip very short chunks
+            
+            for text, page_number in chunks:
+                embedding_text = (section["section_title"] + ": " + text)[:EMBEDDING_MAX_CHARS]
+                if (len(chunks) == 1 and section_embeddings is not None and section_embeddings[i] is not None
+                        and embedding_text == self.section_texts([section])[0].rstrip()):
+                    reused[len(candidates)] = section_embeddings[i]
+                else:
+                    texts.append(embedding_text)
+                candidates.append((section, text, page_number))
+        
+        if not candidates:
+            return []
+        
+        # Encode every chunk that needs it in a single batch
+        embeddings = iter(self.embed_texts(texts))
+        chunk_embeddings = np.stack([reused[i] if i in reused else next(embeddings) for i in range(len(candidates))])
+        scores = chunk_embeddings @ context_embedding
+        
+        # Select the top chunks without sorting all of them, then order by score (ties by position)
+        if len(scores) > TOP_SUBSECTIONS:
+            top = np.argpartition(-scores, TOP_SUBSECTIONS - 1)[:TOP_SUBSECTIONS]
+        else:
+            top = np.arange(len(scores))
+        top = sorted(top, key=lambda i: (-scores[i], i))
+        
         subsections = []
+        for i in top:
+            section, text, page_number = candidates[i]
+            subsections.append({
+                "document": section["document"],
+                "section_title": section["section_title"],
+                "refined_text": text,
+                "page_number": page_number,
+                "relevance_score": float(scores[i])
+            })
         
-        for section in top_sections:
-            # Split section content into paragraphs
-            paragraphs = re.split(r'\n\n|\r\n\r\n', section['content'])
-            
-            # Process each paragraph as a potential subsection
-            for i, paragraph in enumerate(paragraphs):
-                if len(paragraph.strip()) < 50:  # Skip very short paragraphs
-                    continue
-                
-                # Create embedding for paragraph
-                paragraph_embedding = self.model.encode(paragraph)
-                
-                # Calculate similarity score
-                similarity = np.dot(paragraph_embedding, context_embedding) / (
-                    np.linalg.norm(paragraph_embedding) * np.linalg.norm(context_embedding)
-                )
-                
-                # Create subsection entry
-                subsections.append({
-                    "document": section["document"],
-                    "section_title": section["section_title"],
-                    "refined_text": paragraph,
-                    "page_number": section["page_number"],
-                    "relevance_score": similarity
-                })
-        
-        # Sort subsections by relevance score (higher is better)
-        subsections.sort(key=lambda x: x['relevance_score'], reverse=True)
-        
-        return subsections[:15]  # Return top 15 subsections
+        return subsections
+
+def write_output(writer, result):
+    """Write the output of an (input_json_path, output, collection_name) result with an OutputWriter"""
+    input_file, output_data, collection_name = result
+    try:
+        output_file = writer.write(collection_name, output_data)
+        logger.info(f"Output written to: {output_file}")
+    
+    except Exception as e:
+        logger.error(f"Error processing input file {input_file}: {str(e)}")
 
 def process_input_files():
     """Process all input JSON files"""
     analyzer = PersonaDocumentAnalyzer()
     
-    # Create output directory if it doesn't exist
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    # Creates the output directory if it doesn't exist
+    writer = OutputWriter(OUTPUT_DIR)
     
     # Find all input JSON files
     input_files = []
@@ -227,23 +847,26 @@ def process_input_files():
     
     logger.info(f"Found {len(input_files)} input JSON files")
     
-    # Process each input file
-    for input_file in input_files:
-        try:
-            logger.info(f"Processing input file: {input_file}")
-            output_data, collection_name = analyzer.process_collection(input_file)
-            
-            # Write output JSON
-            output_file = os.path.join(OUTPUT_DIR, f"{collection_name}_output.json")
-            with open(output_file, 'w') as f:
-                json.dump(output_data, f, indent=2)
-            
-            logger.info(f"Output written to: {output_file}")
-        
-        except Exception as e:
-            logger.error(f"Error processing input file {input_file}: {str(e)}")
+    # Process all input files together so shared PDFs are only handled once
+    try:
+        if analyzer.state is None:
+            # The pipeline writes each output as soon as its collection is ranked
+            analyzer.process_collections(input_files, lambda result: write_output(writer, result))
+            return
+        results = analyzer.update_collections(analyzer.read_collections(input_files))
+    except Exception as e:
+        logger.error(f"Error processing input files: {str(e)}")
+        return
+    
+    for input_file, output_data, collection_name, changed in results:
+        # Write output JSON, leaving unchanged results untouched
+        output_file = os.path.join(OUTPUT_DIR, f"{collection_name}_output.json")
+        if not changed and os.path.exists(output_file):
+            logger.info(f"Output unchanged: {output_file}")
+            continue
+        write_output(writer, (input_file, output_data, collection_name))
 
 if __name__ == "__main__":
-    logger.info("Starting PDF processing")
+    logger.info(f"Starting PDF processing (resident memory {resident_memory_mb():.0f} MB)")
     process_input_files()
     logger.info("PDF processing completed")
\ No newline at end of file
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import hashlib
+import logging
+
+import numpy as np
+
+from file_cache import LRUFileCache
+from output_writer import ScoredOutput
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text):
+    """Lowercase text with runs of whitespace collapsed; the uncased embedding model sees no difference"""
+    return " ".join(text.lower().split())
+
+class ResultCache(LRUFileCache):
+    """On-disk cache of collection outputs (<key>.json, <key>.npz), keyed by context, PDF contents, model and app version"""
+
+    suffixes = ('.json', '.npz')
+    name = "result cache"
+
+    def __init__(self, cache_dir, max_bytes, ttl_seconds):
+        super().__init__(cache_dir, max_bytes)
+        self.ttl_seconds = ttl_seconds
+
+    def make_key(self, context_text, documents, model_id, params, version):
+        """Build a cache key from the persona and job context text, (content_hash, file name) pairs, the model and the app version"""
+        payload = json.dumps([normalize_text(context_text), sorted(documents), model_id, params, version], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached output for a key, or None if it is not cached or has expired"""
+        def read():
+            with open(self._path(key, '.json'), 'r') as f:
+                output = json.load(f)
+            with np.load(self._path(key, '.npz')) as arrays:
+                return ScoredOutput(output, {name: arrays[name] for name in arrays.files})
+
+        with self.lock:
+            return self._read(key, read)
+
+    def put(self, key, output):
+        """Store an output for a key; expired and old entries are evicted when the index is saved"""
+        arrays = {name: np.asarray(array) for name, array in getattr(output, 'arrays', {}).items()}
+        with self.lock:
+            self._write(key, {
+                '.json': lambda f: f.write(json.dumps(output).encode('utf-8')),
+                '.npz': lambda f: np.savez(f, **arrays)
+            })
+
+    def _expired(self, entry):
+        return time.time() - entry['created'] > self.ttl_seconds
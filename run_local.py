@@ -4,21 +4,20 @@ import os
 import sys
 import subprocess
 import argparse
+import importlib.util
 import time
 
 def check_dependencies():
-    """Check if required dependencies are installed"""
-    try:
-        import fitz
-        import numpy
-        import spacy
-        from sentence_transformers import SentenceTransformer
-        print("All required dependencies are installed.")
-        return True
-    except ImportError as e:
-        print(f"Missing dependency: {e}")
+    """Check if required dependencies are installed without importing them"""
+    missing = [name for name in ("fitz", "numpy", "sentence_transformers")
+               if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"Missing dependency: {', '.join(missing)}")
         print("Please install required dependencies using: pip install -r requirements.txt")
         return False
+    
+    print("All required dependencies are installed.")
+    return True
 
 def run_local_processing(input_dir, output_dir):
     """Run the PDF processing locally without Docker"""
@@ -35,6 +34,8 @@ def run_local_processing(input_dir, output_dir):
     # Run the processing script
     print(f"Processing PDFs from {input_dir}...")
     import process_pdfs
+    print(f"Startup: modules imported in {time.time() - start_time:.2f} seconds, "
+          f"resident memory {process_pdfs.resident_memory_mb():.0f} MB")
     process_pdfs.process_input_files()
     
     # Calculate and display processing time
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import os
+import math
+import time
+import logging
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# Parse scheduling, as fractions of a collection's time budget
+PARSE_BUDGET_SHARE = 0.5  # Parsing is planned to use at most this share of the remaining time
+PARSE_DEADLINE_SHARE = 0.75  # PDFs still parsing at this point of the budget are skipped
+PARSE_GRACE_SHARE = 0.05  # Extra time given to parse workers to return after the parse deadline
+PARSE_SECONDS_PER_PAGE = 0.008  # Cost estimate used until real rates have been measured
+RATE_SAMPLE_PAGES = 3  # Pages read up front to measure the parse rate of a first run
+MIN_SAMPLED_PAGES = 5
+
+class TimeBudget:
+    """Tracks elapsed time against a processing deadline and records what was cut to meet it"""
+
+    def __init__(self, seconds, start_time=None):
+        self.seconds = seconds
+        self.start_time = time.time() if start_time is None else start_time  # May lie ahead for a collection queued behind others
+        self.degradations = []
+        self.sampled_documents = []
+        self.skipped_documents = []
+        self.truncated_documents = []
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def remaining(self):
+        return self.seconds - self.elapsed()
+
+    def deadline(self):
+        return self.start_time + self.seconds
+
+    def degrade(self, action, detail=None):
+        """Record a degradation once, logging why it was applied"""
+        if action not in self.degradations:
+            self.degradations.append(action)
+        logger.warning(f"Time budget: {action}" + (f" ({detail})" if detail else ""))
+
+    def report(self):
+        """Metadata describing what was cut, or None if the run was not degraded"""
+        if not self.degradations:
+            return None
+
+        report = {
+            "budget_seconds": self.seconds,
+            "elapsed_seconds": round(max(0.0, self.elapsed()), 3),
+            "degradations": list(self.degradations)
+        }
+        if self.sampled_documents:
+            report["sampled_documents"] = list(self.sampled_documents)
+        if self.skipped_documents:
+            report["skipped_documents"] = list(self.skipped_documents)
+        if self.truncated_documents:
+            report["truncated_documents"] = list(self.truncated_documents)
+        return report
+
+def estimate_page_count(pdf_path):
+    """Page count of a PDF from its page tree, without extracting any text"""
+    try:
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    except Exception as e:
+        logger.warning(f"Could not estimate cost of PDF {pdf_path}: {str(e)}")
+        return 0
+
+def measure_parse_rate(pdf_path, pages=RATE_SAMPLE_PAGES):
+    """Seconds per page spent extracting the text of the first pages of a PDF, or None if none could be read"""
+    try:
+        with fitz.open(pdf_path) as doc:
+            count = min(pages, doc.page_count)
+            start_time = time.perf_counter()
+            for page_num in range(count):
+                doc[page_num].get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES)
+            # Opening the PDF is paid once per document rather than per page
+            seconds = time.perf_counter() - start_time
+    except Exception as e:
+        logger.warning(f"Could not measure parse rate on PDF {pdf_path}: {str(e)}")
+        return None
+    return seconds / count if count else None
+
+def order_by_cost(items, costs):
+    """Order items by descending cost so the longest jobs start first"""
+    return [item for _, item in sorted(zip(costs, items), key=lambda pair: -pair[0])]
+
+def sample_pages(page_count, max_pages):
+    """Evenly spaced page indices covering a document with at most max_pages pages"""
+    if max_pages is None or page_count <= max_pages:
+        return None
+    step = page_count / max_pages
+    return sorted(set(math.floor(i * step) for i in range(max_pages)))
+
+def plan_parsing(collections, pending, budgets, page_counts, seconds_per_page):
+    """Order pending PDFs collection by collection, sampling pages of those whose collection would run out of time"""
+    remaining = set(pending)
+    ordered = []
+    page_plans = {}  # Page indices to extract for each sampled PDF
+    planned_seconds = 0.0
+    for collection, budget in zip(collections, budgets):
+        # The PDFs a collection adds to those of the collections before it only count against its own budget
+        added = [pdf_path for pdf_path in dict.fromkeys(collection["pdf_paths"]) if pdf_path in remaining]
+        remaining.difference_update(added)
+        added = order_by_cost(added, [page_counts[pdf_path] for pdf_path in added])
+        ordered.extend(added)
+
+        pages = sum(page_counts[pdf_path] for pdf_path in added)
+        estimated_seconds = pages * seconds_per_page
+        allowed_seconds = budget.remaining() * PARSE_BUDGET_SHARE - planned_seconds
+        if estimated_seconds > allowed_seconds:
+            keep = max(0.0, allowed_seconds) / estimated_seconds
+            for pdf_path in added:
+                page_count = page_counts[pdf_path]
+                page_indices = sample_pages(page_count, max(MIN_SAMPLED_PAGES, int(page_count * keep)))
+                if page_indices is not None:
+                    page_plans[pdf_path] = page_indices
+                    pages -= page_count - len(page_indices)
+                    record_sampling(collections, budgets, pdf_path, len(page_indices), page_count,
+                                    f"{estimated_seconds:.1f}s estimated, {allowed_seconds:.1f}s allowed")
+        planned_seconds += pages * seconds_per_page
+
+    # PDFs loaded without a collection have no deadline
+    rest = [pdf_path for pdf_path in pending if pdf_path in remaining]
+    ordered.extend(order_by_cost(rest, [page_counts[pdf_path] for pdf_path in rest]))
+    return ordered, page_plans
+
+def record_sampling(collections, budgets, pdf_path, sampled, page_count, detail):
+    """Record a sampled PDF on the budget of every collection using it"""
+    document = os.path.basename(pdf_path)
+    for collection, budget in zip(collections, budgets):
+        if pdf_path in collection["pdf_paths"]:
+            budget.sampled_documents.append(document)
+            budget.degrade("sampled_pages", f"{document} sampled to {sampled} of {page_count} pages; {detail}")
+
+def parse_deadlines(budgets):
+    """Time after which no more pages of a PDF are read and time by which parse workers must report back"""
+    if not budgets:
+        return None, None
+    # A PDF must be parsed in time for the first collection using it
+    budget = min(budgets, key=lambda budget: budget.deadline())
+    deadline = budget.start_time + budget.seconds * PARSE_DEADLINE_SHARE
+    return deadline, deadline + budget.seconds * PARSE_GRACE_SHARE
+
+def skip_document(pdf_path, budgets):
+    """Record a PDF that was dropped because parsing ran out of time on every collection using it"""
+    for budget in budgets:
+        budget.skipped_documents.append(os.path.basename(pdf_path))
+        budget.degrade("skipped_documents", f"{os.path.basename(pdf_path)} not parsed before the deadline")
+
+def truncate_document(pdf_path, pages, budgets):
+    """Record a PDF whose parsing stopped at the deadline on every collection using it"""
+    for budget in budgets:
+        budget.truncated_documents.append(os.path.basename(pdf_path))
+        budget.degrade("truncated_documents", f"{os.path.basename(pdf_path)} stopped after {pages} pages")
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import logging
+from collections import Counter
+
+import fitz  # PyMuPDF
+
+from section_store import make_section
+
+logger = logging.getLogger(__name__)
+
+# Text extraction without the image data that "dict" output includes by default, with ligatures expanded
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES & ~fitz.TEXT_PRESERVE_LIGATURES
+HEADER_SIZE_RATIO = 1.15  # Lines this much larger than the body text may be headers
+HEADER_MAX_CHARS = 120
+MIN_OUTLINE_ENTRIES = 2  # Documents with a shorter outline are split by font statistics
+NON_HEADER_PATTERN = re.compile(r'^(?:fig(?:ure)?|table|chart|page)\.?\s*\d', re.IGNORECASE)
+
+def new_parse_stats():
+    """Stage timings and counts of parsing one PDF, filled in by the extractors"""
+    return {"pdf_open": 0.0, "text_extraction": 0.0, "section_detection": 0.0, "pages": 0, "sections": 0,
+            "truncated": False, "failed": False}
+
+class SectionBuilder:
+    """Accumulates text into sections, tracking the pages each section spans"""
+
+    def __init__(self, document, continued=False):
+        self.document = document
+        self.title = None
+        self.collecting = continued  # Text before the first header otherwise belongs to no section
+        self.text_parts = []
+        self.page_numbers = []
+        self.page_offsets = []
+        self.content_length = 0
+
+    def start(self, title, page_number):
+        """Start a new section, returning the previous one if it has any text"""
+        section = self.finish()
+        self.title = title
+        self.collecting = True
+        self.text_parts = []
+        self.page_numbers = [page_number]
+        self.page_offsets = [0]
+        self.content_length = 0
+        return section
+
+    def add(self, text, page_number):
+        if not self.collecting:
+            return
+        if not self.page_numbers or self.page_numbers[-1] != page_number:
+            self.page_numbers.append(page_number)
+            self.page_offsets.append(self.content_length)
+        self.text_parts.append(text)
+        self.content_length += len(text) + 1
+
+    def extend(self, text_parts, page_numbers, page_offsets):
+        """Append text that continues the current section in a later page range"""
+        if not self.collecting:
+            return
+        for page_number, page_offset in zip(page_numbers, page_offsets):
+            if not self.page_numbers or self.page_numbers[-1] != page_number:
+                self.page_numbers.append(page_number)
+                self.page_offsets.append(self.content_length + page_offset)
+        self.text_parts.extend(text_parts)
+        self.content_length += sum(len(text) + 1 for text in text_parts)
+
+    def state(self):
+        """(title, text_parts, page_numbers, page_offsets) of the section still open, or None"""
+        if not self.collecting:
+            return None
+        return self.title, self.text_parts, self.page_numbers, self.page_offsets
+
+    def resume(self, state):
+        """Continue a section from its state, returning the previous section if it has any text"""
+        section = self.finish()
+        self.title, text_parts, page_numbers, page_offsets = state
+        self.collecting = True
+        self.text_parts = list(text_parts)
+        self.page_numbers = list(page_numbers)
+        self.page_offsets = list(page_offsets)
+        self.content_length = sum(len(text) + 1 for text in text_parts)
+        return section
+
+    def finish(self):
+        if self.collecting and self.text_parts:
+            return make_section(self.document, self.title, self.text_parts, self.page_numbers, self.page_offsets)
+        return None
+
+def open_pdf(pdf_path):
+    """Open a PDF by path, so each shard reads only the objects of its pages and workers share the OS page cache"""
+    return fitz.open(pdf_path)
+
+def is_header_text(text):
+    """Whether a line could be a header rather than a page number, figure label or stray symbol"""
+    return (len(text) <= HEADER_MAX_CHARS and any(c.isalpha() for c in text)
+            and not NON_HEADER_PATTERN.match(text))
+
+def iter_pages(doc, stats=None, page_indices=None, deadline=None):
+    """Yield (page_number, page) for the pages to read, stopping at the deadline"""
+    for page_num in (range(doc.page_count) if page_indices is None else page_indices):
+        if deadline is not None and time.time() > deadline:
+            if stats is not None:
+                stats["truncated"] = True
+            break
+        if stats is not None:
+            stats["pages"] += 1
+        yield page_num + 1, doc[page_num]
+
+def timed_text(page, option, stats=None, **kwargs):
+    start_time = time.perf_counter()
+    text = page.get_text(option, flags=TEXT_FLAGS, **kwargs)
+    if stats is not None:
+        stats["text_extraction"] += time.perf_counter() - start_time
+    return text
+
+def iter_lines(doc, stats=None, page_indices=None, deadline=None):
+    """Yield (page_number, font_size, text) for each text line, with spans of a line joined"""
+    for page_number, page in iter_pages(doc, stats, page_indices, deadline):
+        for block in timed_text(page, "dict", stats)["blocks"]:
+            for line in block.get("lines", ()):
+                text = "".join(span["text"] for span in line["spans"]).strip()
+                if text:
+                    yield page_number, round(max(span["size"] for span in line["spans"]), 1), text
+
+def body_font_size(lines):
+    """Most common font size, weighted by the number of characters set in it"""
+    histogram = Counter()
+    for _, font_size, text in lines:
+        histogram[font_size] += len(text)
+    return histogram.most_common(1)[0][0] if histogram else 0.0
+
+def font_sections(document, lines):
+    """Split lines into sections at lines set clearly larger than the document's body text"""
+    threshold = body_font_size(lines) * HEADER_SIZE_RATIO
+    builder = SectionBuilder(document)
+    previous_header = None  # (page_number, font_size) of the previous line if it was a header
+
+    for page_number, font_size, text in lines:
+        if font_size >= threshold and is_header_text(text):
+            if previous_header == (page_number, font_size) and not builder.text_parts:
+                # Headers wrapped over several lines form one title
+                builder.title += " " + text
+            else:
+                section = builder.start(text, page_number)
+                if section:
+                    yield section
+            previous_header = (page_number, font_size)
+        else:
+            builder.add(text, page_number)
+            previous_header = None
+
+    section = builder.finish()
+    if section:
+        yield section
+
+def outline_sections(document, doc, outline, stats=None, page_indices=None, deadline=None, builder=None):
+    """Split a document at the entries of its outline, locating each title in the text of its page"""
+    titles_by_page = {}
+    for title, page_number in outline:
+        titles_by_page.setdefault(page_number, []).append(" ".join(title.split()))
+
+    finish = builder is None
+    builder = builder or SectionBuilder(document)
+    for page_number, page in iter_pages(doc, stats, page_indices, deadline):
+        text = " ".join(" ".join(block[4].split()) for block in timed_text(page, "blocks", stats) if block[6] == 0)
+        lowered = text.lower()
+
+        # Titles are searched in outline order; a title that is not found starts its section where the previous ended
+        position = 0
+        for title in titles_by_page.get(page_number, ()):
+            start = lowered.find(title.lower(), position)
+            end = start + len(title)
+            if start < 0:
+                start = end = position
+            if text[position:start].strip():
+                builder.add(text[position:start].strip(), page_number)
+            section = builder.start(title, page_number)
+            if section:
+                yield section
+            position = end
+
+        if text[position:].strip():
+            builder.add(text[position:].strip(), page_number)
+
+    section = builder.finish() if finish else None
+    if section:
+        yield section
+
+def open_structured(pdf_path, stats=None):
+    """Open a PDF, returning it with its outline as (title, page_number) pairs"""
+    start_time = time.perf_counter()
+    doc = open_pdf(pdf_path)
+    outline = [(title, page_number) for _, title, page_number in doc.get_toc(simple=True)
+               if page_number >= 1 and title.strip()]
+    if stats is not None:
+        stats["pdf_open"] += time.perf_counter() - start_time
+    return doc, outline
+
+def iter_structured_sections(pdf_path, stats=None, page_indices=None, deadline=None):
+    """Yield sections of a PDF from its outline or, without one, from per-document font statistics"""
+    doc, outline = open_structured(pdf_path, stats)
+    document = os.path.basename(pdf_path)
+    try:
+        if len(outline) >= MIN_OUTLINE_ENTRIES:
+            yield from outline_sections(document, doc, outline, stats, page_indices, deadline)
+        else:
+            # The body text size is only known once every page has been read
+            yield from font_sections(document, list(iter_lines(doc, stats, page_indices, deadline)))
+    finally:
+        doc.close()
+
+def structured_shard(pdf_path, stats=None, page_indices=None, deadline=None, continued=False):
+    """Extract one page-range shard of a PDF as (sections, open_state, lines) for ShardStitcher"""
+    doc, outline = open_structured(pdf_path, stats)
+    try:
+        if len(outline) >= MIN_OUTLINE_ENTRIES:
+            builder = SectionBuilder(os.path.basename(pdf_path), continued)
+            sections = list(outline_sections(builder.document, doc, outline, stats, page_indices, deadline, builder))
+            return sections, builder.state(), None
+        return [], None, list(iter_lines(doc, stats, page_indices, deadline))
+    finally:
+        doc.close()
+
+def section_state(section):
+    """Builder state of a finished section"""
+    # Content is the joined text parts plus a trailing space
+    return section["section_title"], [section["content"][:-1]], section["page_numbers"], section["page_offsets"]
+
+class ShardStitcher:
+    """Joins the (sections, open_state, lines) results of consecutive page-range shards as they arrive in page order"""
+
+    def __init__(self, document):
+        self.document = document
+        self.builder = SectionBuilder(document)
+        self.lines = None
+
+    def add(self, shard):
+        """Add the next shard, returning the sections it finished"""
+        sections, open_state, lines = shard
+        if lines is not None:
+            if self.lines is None:
+                self.lines = []
+            self.lines.extend(lines)
+            return []
+
+        finished = []
+        states = [section_state(section) for section in sections]
+        for state in states + ([open_state] if open_state is not None else []):
+            if state[0] is None:
+                self.builder.extend(*state[1:])
+            else:
+                section = self.builder.resume(state)
+                if section:
+                    finished.append(section)
+        return finished
+
+    def finish(self):
+        """Sections still open after the last shard"""
+        if self.lines is not None:
+            return list(font_sections(self.document, self.lines))
+        section = self.builder.finish()
+        return [section] if section else []
+
+class ShardedParse:
+    """Stitches the ((sections, open_state, lines), stats) results of a PDF's shards in page order, whatever order they come back in"""
+
+    def __init__(self, pdf_path, count):
+        self.stitcher = ShardStitcher(os.path.basename(pdf_path))
+        self.count = count
+        self.results = {}  # Shards that came back before the shards preceding them
+        self.next_index = 0
+        self.stats = new_parse_stats()
+
+    def add(self, index, result):
+        """Add the result of a shard, None if it missed the deadline, returning the sections this finishes"""
+        self.results[index] = result
+        start_time = time.perf_counter()
+        sections = []
+        while self.next_index in self.results:
+            result = self.results.pop(self.next_index)
+            self.next_index += 1
+            if result is None:
+                # A missing shard leaves a gap in the document
+                self.stats["truncated"] = True
+                continue
+
+            shard, shard_stats = result
+            for stage in ("pdf_open", "text_extraction", "section_detection", "pages"):
+                self.stats[stage] += shard_stats[stage]
+            self.stats["truncated"] = self.stats["truncated"] or shard_stats["truncated"]
+            self.stats["failed"] = self.stats["failed"] or shard_stats["failed"]
+            sections.extend(self.stitcher.add(shard))
+
+        if self.done():
+            sections.extend(self.stitcher.finish())
+        self.stats["section_detection"] += time.perf_counter() - start_time
+        self.stats["sections"] += len(sections)
+        return sections
+
+    def done(self):
+        return self.next_index == self.count
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+def make_section(document, section_title, text_parts, page_numbers, page_offsets):
+    """Build a section dict from its buffered text spans"""
+    return {
+        "document": document,
+        "section_title": section_title,
+        "content": " ".join(text_parts) + " ",
+        "page_numbers": page_numbers,
+        "page_offsets": page_offsets
+    }
+
+class SectionStore:
+    """Columnar storage for the sections of documents, building section dicts only on access"""
+
+    def __init__(self, documents, document_ids, titles, title_ids, text, text_offsets,
+                 pages, page_starts, page_text_offsets):
+        self.documents = documents
+        self.document_ids = document_ids
+        self.titles = titles
+        self.title_ids = title_ids
+        self.text = text
+        self.text_offsets = text_offsets  # Content of section i is text[text_offsets[i]:text_offsets[i + 1]]
+        self.pages = pages  # Pages of section i are pages[page_starts[i]:page_starts[i + 1]]
+        self.page_starts = page_starts
+        self.page_text_offsets = page_text_offsets
+
+    @classmethod
+    def from_sections(cls, sections):
+        """Build a store from an iterable of section dicts"""
+        documents = {}
+        titles = {}
+        document_ids = []
+        title_ids = []
+        contents = []
+        text_offsets = [0]
+        pages = []
+        page_starts = [0]
+        page_text_offsets = []
+
+        for section in sections:
+            document_ids.append(documents.setdefault(section["document"], len(documents)))
+            title_ids.append(titles.setdefault(section["section_title"], len(titles)))
+            contents.append(section["content"])
+            text_offsets.append(text_offsets[-1] + len(section["content"]))
+            pages.extend(section["page_numbers"])
+            page_starts.append(len(pages))
+            page_text_offsets.extend(section.get("page_offsets") or [0] * len(section["page_numbers"]))
+
+        return cls(list(documents), np.array(document_ids, dtype=np.int32), list(titles), np.array(title_ids, dtype=np.int32),
+                   "".join(contents), np.array(text_offsets, dtype=np.int64), np.array(pages, dtype=np.int32),
+                   np.array(page_starts, dtype=np.int64), np.array(page_text_offsets, dtype=np.int64))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a store saved with to_dict"""
+        return cls(data["documents"], np.array(data["document_ids"], dtype=np.int32),
+                   data["titles"], np.array(data["title_ids"], dtype=np.int32),
+                   data["text"], np.array(data["text_offsets"], dtype=np.int64),
+                   np.array(data["pages"], dtype=np.int32), np.array(data["page_starts"], dtype=np.int64),
+                   np.array(data["page_text_offsets"], dtype=np.int64))
+
+    def to_dict(self):
+        """JSON-serializable columns of the store"""
+        return {
+            "documents": self.documents,
+            "document_ids": self.document_ids.tolist(),
+            "titles": self.titles,
+            "title_ids": self.title_ids.tolist(),
+            "text": self.text,
+            "text_offsets": self.text_offsets.tolist(),
+            "pages": self.pages.tolist(),
+            "page_starts": self.page_starts.tolist(),
+            "page_text_offsets": self.page_text_offsets.tolist()
+        }
+
+    def __len__(self):
+        return len(self.text_offsets) - 1
+
+    def __getitem__(self, i):
+        """Materialize section i as a dict"""
+        page_start, page_end = self.page_starts[i], self.page_starts[i + 1]
+        return {
+            "document": self.document(i),
+            "section_title": self.title(i),
+            "content": self.content(i),
+            "page_numbers": self.pages[page_start:page_end].tolist(),
+            "page_offsets": self.page_text_offsets[page_start:page_end].tolist()
+        }
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def document(self, i):
+        return self.documents[self.document_ids[i]]
+
+    def title(self, i):
+        return self.titles[self.title_ids[i]]
+
+    def content(self, i, max_chars=None):
+        start, end = self.text_offsets[i], self.text_offsets[i + 1]
+        if max_chars is not None:
+            end = min(end, start + max_chars)
+        return self.text[start:end]
+
+    def texts(self, max_chars):
+        """Title and content of each section truncated to max_chars, without copying whole contents"""
+        texts = []
+        for i in range(len(self)):
+            prefix = self.title(i) + ": "
+            texts.append((prefix + self.content(i, max(0, max_chars - len(prefix))))[:max_chars])
+        return texts
+
+    def with_document(self, document):
+        """The same sections attributed to a single, possibly renamed document"""
+        return SectionStore([document], np.zeros_like(self.document_ids), self.titles, self.title_ids, self.text,
+                            self.text_offsets, self.pages, self.page_starts, self.page_text_offsets)
+
+    def to_sections(self):
+        return list(self)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import sys
+import socket
+import argparse
+import threading
+import http.client
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from process_pdfs import PersonaDocumentAnalyzer, INPUT_DIR
+
+logger = logging.getLogger(__name__)
+
+# Constants
+SERVER_HOST = os.environ.get('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', '8080'))
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', '2'))  # Collections processed concurrently
+SERVER_QUEUE_SIZE = int(os.environ.get('SERVER_QUEUE_SIZE', '8'))  # Requests waiting for a worker
+MAX_REQUEST_BYTES = 1024 * 1024
+
+class AnalyzerService:
+    """Keeps a warm analyzer and runs collection requests on a bounded worker pool"""
+
+    def __init__(self, analyzer, workers=SERVER_WORKERS, queue_size=SERVER_QUEUE_SIZE):
+        self.analyzer = analyzer
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Requests beyond running plus queued capacity are rejected instead of piling up
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, input_data):
+        """Queue a collection request, returning a future or None when the service is full"""
+        if not self.slots.acquire(blocking=False):
+            return None
+
+        try:
+            future = self.executor.submit(self.process, input_data)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def process(self, input_data):
+        """Process one collection given as input JSON data"""
+        # PDFs are resolved on the server side, relative to input_dir
+        pdf_base_dir = input_data.get('input_dir', INPUT_DIR)
+        collection = self.analyzer.parse_collection(input_data, pdf_base_dir)
+        _, output, _ = self.analyzer.pipeline_collections([collection])[0]
+        return output
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.analyzer.shutdown()
+
+class AnalyzerRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler: GET /health and POST /process with an input JSON body"""
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != '/process':
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length <= 0 or length > MAX_REQUEST_BYTES:
+            self.send_json(400, {"error": "Request body must be an input JSON document"})
+            return
+
+        try:
+            input_data = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.send_json(400, {"error": f"Invalid JSON: {str(e)}"})
+            return
+        if not isinstance(input_data, dict):
+            self.send_json(400, {"error": "Input JSON must be an object"})
+            return
+
+        future = self.server.service.submit(input_data)
+        if future is None:
+            self.send_json(503, {"error": "Server busy"}, {"Retry-After": "1"})
+            return
+
+        try:
+            output = future.result()
+        except (KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"Invalid input JSON: {str(e)}"})
+            return
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            self.send_json(500, {"error": str(e)})
+            return
+
+        self.send_json(200, output)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no host/port
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+class AnalyzerHTTPServer(ThreadingHTTPServer):
+    """HTTP server listening on a TCP port"""
+    request_queue_size = 128
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """HTTP server listening on a local Unix socket"""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def create_server(service, host=SERVER_HOST, port=SERVER_PORT, socket_path=None):
+    """Create an HTTP server bound to a TCP port or, if given, a Unix socket"""
+    if socket_path:
+        server = ThreadingUnixHTTPServer(socket_path, AnalyzerRequestHandler)
+    else:
+        server = AnalyzerHTTPServer((host, port), AnalyzerRequestHandler)
+    server.service = service
+    return server
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a local Unix socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def request_collection(input_data, host=SERVER_HOST, port=SERVER_PORT, socket_path=None, timeout=None):
+    """Send a collection request to a running server and return (status, response JSON)"""
+    if socket_path:
+        connection = UnixHTTPConnection(socket_path, timeout=timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    try:
+        body = json.dumps(input_data)
+        connection.request('POST', '/process', body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Persona-Driven Document Intelligence analyzer with warm models")
+    parser.add_argument("--mode", choices=["serve", "client"], default="serve",
+                        help="Run the server or send an input JSON file to a running server")
+    parser.add_argument("--host", default=SERVER_HOST, help="Host to bind or connect to")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to bind or connect to")
+    parser.add_argument("--socket", help="Use a Unix socket at this path instead of TCP")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Collections processed concurrently")
+    parser.add_argument("--queue-size", type=int, default=SERVER_QUEUE_SIZE, help="Requests allowed to wait for a worker")
+    parser.add_argument("--input", help="Input JSON file to send in client mode")
+
+    args = parser.parse_args()
+
+    if args.mode == "client":
+        with open(args.input, 'r') as f:
+            input_data = json.load(f)
+        input_data.setdefault('input_dir', os.path.dirname(os.path.abspath(args.input)))
+        status, response = request_collection(input_data, args.host, args.port, args.socket)
+        print(json.dumps(response, indent=2))
+        if status != 200:
+            sys.exit(1)
+        return
+
+    service = AnalyzerService(PersonaDocumentAnalyzer(), args.workers, args.queue_size)
+    server = create_server(service, args.host, args.port, args.socket)
+    logger.info(f"Serving on {args.socket or f'{args.host}:{args.port}'}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+if __name__ == "__main__":
+    main()
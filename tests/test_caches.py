@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+import process_pdfs
+from result_cache import ResultCache
+
+TTL = 3600
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("time.time", clock)
+    return clock
+
+def output(name):
+    return {"metadata": {"collection": name}, "extracted_sections": [{"section_title": name}]}
+
+def put_all(cache, clock, names):
+    for name in names:
+        clock.now += 1
+        cache.put(name, output(name))
+
+def test_instances_sharing_a_directory_keep_each_others_puts(tmp_path, clock):
+    first = ResultCache(str(tmp_path), 1 << 20, TTL)
+    second = ResultCache(str(tmp_path), 1 << 20, TTL)
+    put_all(first, clock, ["a", "b"])
+    put_all(second, clock, ["c"])
+    first.save()
+    second.save()
+
+    reopened = ResultCache(str(tmp_path), 1 << 20, TTL)
+    assert sorted(reopened.index) == ["a", "b", "c"]
+    assert all(reopened.get(name)["metadata"] == {"collection": name} for name in "abc")
+
+def test_access_does_not_bring_back_an_evicted_entry(tmp_path, clock):
+    first = ResultCache(str(tmp_path), 1 << 20, TTL)
+    put_all(first, clock, ["a", "b"])
+    first.save()
+
+    second = ResultCache(str(tmp_path), 1 << 20, TTL)
+    clock.now += 1
+    assert second.get("a") is not None
+
+    # The first instance evicts "a", the least recently used entry it knows of, before the second saves its access
+    first.max_bytes = first.index["b"]["size"]
+    clock.now += 1
+    first.get("b")
+    first.save()
+    second.save()
+
+    reopened = ResultCache(str(tmp_path), 1 << 20, TTL)
+    assert sorted(reopened.index) == ["b"]
+    assert reopened.get("a") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "a.json"))
+
+def test_expired_entries_are_dropped(tmp_path, clock):
+    cache = ResultCache(str(tmp_path), 1 << 20, TTL)
+    put_all(cache, clock, ["a"])
+    cache.save()
+
+    clock.now += TTL - 10
+    assert cache.get("a") is not None
+    put_all(cache, clock, ["b"])
+    clock.now += 20
+    # Reading does not extend the lifetime of an entry
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    cache.save()
+    assert sorted(ResultCache(str(tmp_path), 1 << 20, TTL).index) == ["b"]
+
+def test_eviction_removes_least_recently_used_first(tmp_path, clock):
+    cache = ResultCache(str(tmp_path), 1 << 20, TTL)
+    put_all(cache, clock, ["a", "b", "c", "d"])
+    clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.get("c")
+
+    # Room for two entries: "b" and "d" were used least recently
+    cache.max_bytes = cache.index["a"]["size"] + cache.index["c"]["size"]
+    cache.save()
+    assert sorted(cache.index) == ["a", "c"]
+    assert sorted(ResultCache(str(tmp_path), 1 << 20, TTL).index) == ["a", "c"]
+    assert not os.path.exists(os.path.join(str(tmp_path), "b.npz"))
+
+def test_hit_refreshes_only_the_timestamp(tmp_path):
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 not parsed by this test")
+    analyzer = process_pdfs.PersonaDocumentAnalyzer()
+    analyzer.result_cache = ResultCache(str(tmp_path / "results"), 1 << 20, TTL)
+    collection = analyzer.parse_collection({
+        "collection_name": "Trip",
+        "pdf_files": ["doc.pdf"],
+        "persona": {"role": "Travel Planner", "expertise": ["logistics"], "focus_areas": ["budget travel"]},
+        "job_to_be_done": "Plan a four-day trip"
+    }, str(tmp_path))
+
+    runs = []
+    def run(collections):
+        runs.append(collections)
+        return [(None, dict(output("Trip"), metadata=analyzer.output_metadata(collection)), "Trip")
+                for collection in collections]
+
+    (_, missed, _), = analyzer.run_cached([collection], run)
+    (_, hit, _), = analyzer.run_cached([collection], run)
+    assert len(runs) == 1
+    assert missed["metadata"]["result_cache"] == "miss"
+    assert hit["metadata"]["result_cache"] == "hit"
+    assert hit["metadata"]["processing_timestamp"] >= missed["metadata"]["processing_timestamp"]
+
+    ignored = ("processing_timestamp", "result_cache")
+    strip = lambda output: dict(output, metadata={k: v for k, v in output["metadata"].items() if k not in ignored})
+    assert strip(hit) == strip(missed)
@@ -0,0 +1,126 @@
+import json
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+import process_pdfs
+from benchmark import generate_synthetic_pdf
+
+DIM = 32
+
+class BagOfWordsModel:
+    """Deterministic stand-in for the embedding model, recording what it encodes"""
+
+    def __init__(self):
+        self.encoded = []
+
+    def dimension(self):
+        return DIM
+
+    def encode(self, texts, batch_size):
+        self.encoded.extend(texts)
+        embeddings = np.zeros((len(texts), DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                embeddings[i, zlib.crc32(word.encode('utf-8')) % DIM] += 1
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    monkeypatch.setattr(process_pdfs, "STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setattr(process_pdfs, "CACHE_DIR", "")
+    monkeypatch.setattr(process_pdfs, "RESULT_CACHE_DIR", "")
+    # Parse in a thread of this process, so the parses can be recorded
+    monkeypatch.setattr(process_pdfs, "PARSE_WORKERS", 1)
+    analyzer = process_pdfs.PersonaDocumentAnalyzer()
+    analyzer._model = BagOfWordsModel()
+
+    analyzer.parsed = []
+    extract_job_with_stats = process_pdfs.extract_job_with_stats
+    def recording_extract(pdf_path, *args, **kwargs):
+        analyzer.parsed.append(os.path.basename(pdf_path))
+        return extract_job_with_stats(pdf_path, *args, **kwargs)
+    monkeypatch.setattr(process_pdfs, "extract_job_with_stats", recording_extract)
+
+    analyzer.embedded = []
+    embed_chunks = analyzer.embed_chunks
+    def recording_embed_chunks(chunks, *args):
+        analyzer.embedded.extend(chunks)
+        return embed_chunks(chunks, *args)
+    monkeypatch.setattr(analyzer, "embed_chunks", recording_embed_chunks)
+
+    analyzer.saved = []
+    save = analyzer.state.save
+    def recording_save(input_json_path, *args):
+        analyzer.saved.append(input_json_path)
+        return save(input_json_path, *args)
+    monkeypatch.setattr(analyzer.state, "save", recording_save)
+    return analyzer
+
+def write_collection(directory, pdf_files, role="Researcher"):
+    for seed, pdf_file in enumerate(pdf_files):
+        if not os.path.exists(os.path.join(directory, pdf_file)):
+            generate_synthetic_pdf(os.path.join(directory, pdf_file), 3, seed=seed)
+    input_json_path = os.path.join(directory, "input.json")
+    with open(input_json_path, 'w') as f:
+        json.dump({
+            "collection_name": "Library",
+            "pdf_files": pdf_files,
+            "persona": {"role": role, "expertise": ["statistics"], "focus_areas": ["methodology"]},
+            "job_to_be_done": "Summarize the evaluation methods"
+        }, f)
+    return input_json_path
+
+def update(analyzer, input_json_path):
+    analyzer.parsed.clear()
+    analyzer.embedded.clear()
+    analyzer.saved.clear()
+    analyzer.model.encoded.clear()
+    (_, output, _, changed), = analyzer.update_collections([analyzer.read_collection(input_json_path)])
+    return output, changed
+
+def test_unchanged_collection_is_not_recomputed(analyzer, tmp_path):
+    input_json_path = write_collection(str(tmp_path), ["a.pdf", "b.pdf"])
+    first, changed = update(analyzer, input_json_path)
+    assert changed
+    assert sorted(analyzer.parsed) == ["a.pdf", "b.pdf"]
+    assert analyzer.saved == [input_json_path]
+
+    second, changed = update(analyzer, input_json_path)
+    assert not changed
+    assert analyzer.parsed == [] and analyzer.saved == [] and analyzer.model.encoded == []
+    assert second == first
+
+def test_persona_change_only_rescores(analyzer, tmp_path):
+    input_json_path = write_collection(str(tmp_path), ["a.pdf", "b.pdf"])
+    update(analyzer, input_json_path)
+
+    write_collection(str(tmp_path), ["a.pdf", "b.pdf"], role="Auditor")
+    output, changed = update(analyzer, input_json_path)
+    assert changed
+    assert output["metadata"]["persona"]["role"] == "Auditor"
+    assert analyzer.parsed == []
+    # The new context is embedded, while the stored section embeddings are reused
+    assert analyzer.model.encoded[0].startswith("Role: Auditor")
+    assert analyzer.embedded == []
+
+def test_added_pdf_is_the_only_one_parsed(analyzer, tmp_path):
+    input_json_path = write_collection(str(tmp_path), ["a.pdf", "b.pdf"])
+    update(analyzer, input_json_path)
+
+    write_collection(str(tmp_path), ["a.pdf", "b.pdf", "c.pdf"])
+    output, changed = update(analyzer, input_json_path)
+    assert changed
+    assert analyzer.parsed == ["c.pdf"]
+    assert output["metadata"]["input_documents"] == ["a.pdf", "b.pdf", "c.pdf"]
+
+def test_pdf_that_failed_to_parse_is_parsed_again(analyzer, tmp_path):
+    (tmp_path / "broken.pdf").write_bytes(b"not a PDF")
+    input_json_path = write_collection(str(tmp_path), ["a.pdf", "broken.pdf"])
+    update(analyzer, input_json_path)
+    assert sorted(analyzer.parsed) == ["a.pdf", "broken.pdf"]
+
+    update(analyzer, input_json_path)
+    assert analyzer.parsed == ["broken.pdf"]
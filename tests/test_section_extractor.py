@@ -0,0 +1,40 @@
+import pytest
+
+import process_pdfs
+from benchmark import generate_synthetic_pdf
+from process_pdfs import extract_sections_with_stats, extract_shard_with_stats
+from section_extractor import ShardedParse
+from section_store import SectionStore
+
+PAGES = 12
+
+@pytest.fixture(scope="module", params=["plain", "outline", "footer"])
+def pdf_path(request, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("pdfs") / f"{request.param}.pdf")
+    generate_synthetic_pdf(path, PAGES, header_density=1.5, seed=7, outline=request.param == "outline",
+                           footer_font_size=9 if request.param == "footer" else None)
+    return path
+
+def shard_ranges(pages, shard_pages):
+    return [range(start, min(start + shard_pages, pages)) for start in range(0, pages, shard_pages)]
+
+@pytest.mark.parametrize("extractor", ["heuristic", "structure"])
+@pytest.mark.parametrize("shard_pages", [1, 2, 5, PAGES])
+def test_stitched_shards_match_serial_pass(pdf_path, extractor, shard_pages, monkeypatch):
+    monkeypatch.setattr(process_pdfs, "SECTION_EXTRACTOR", extractor)
+    serial, _ = extract_sections_with_stats(pdf_path)
+    assert len(serial)
+
+    ranges = shard_ranges(PAGES, shard_pages)
+    results = [extract_shard_with_stats(pdf_path, page_indices, continued=i > 0) for i, page_indices in enumerate(ranges)]
+
+    # Shards come back in any order; sections are only handed on once the shards before them are in
+    parse = ShardedParse(pdf_path, len(ranges))
+    stitched = []
+    for index in reversed(range(len(ranges))):
+        stitched.extend(parse.add(index, results[index]))
+    assert parse.done()
+    assert parse.stats["pages"] == PAGES
+    assert parse.stats["sections"] == len(stitched)
+
+    assert SectionStore.from_sections(stitched).to_sections() == serial.to_sections()
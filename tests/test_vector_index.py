@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+
+import vector_index
+from vector_index import VectorIndex
+
+MODEL = "test-model"
+DIM = 16
+
+def normalized(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def make_documents(vectors, per_document, prefix="doc"):
+    """(doc_id, content_hash, sections, embeddings) with each section recording its vector's row"""
+    documents = []
+    for start in range(0, len(vectors), per_document):
+        doc_id = f"{prefix}{start // per_document}"
+        sections = [{"document": doc_id, "row": start + i} for i in range(len(vectors[start:start + per_document]))]
+        documents.append((doc_id, doc_id, sections, vectors[start:start + per_document]))
+    return documents
+
+def brute_force(documents, query, k):
+    """(similarity, section) of the k best sections, best first and earlier sections winning ties"""
+    scored = [(float(np.float32(embedding @ query)), section)
+              for _, _, sections, embeddings in documents for section, embedding in zip(sections, embeddings)]
+    return sorted(scored, key=lambda pair: -pair[0])[:k]
+
+def assert_same_results(results, expected):
+    assert [section for _, section in results] == [section for _, section in expected]
+    np.testing.assert_allclose([score for score, _ in results], [score for score, _ in expected], rtol=1e-5)
+
+def test_exhaustive_search_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    documents = make_documents(normalized(rng.normal(size=(300, DIM))), 40)
+    index = VectorIndex(str(tmp_path), MODEL)
+    # Several add calls spread the documents over several segments
+    index.add(documents[:3])
+    index.add(documents[3:])
+    assert len(index) == 300
+    assert index.stats()["lists"] == 0
+
+    for query in normalized(rng.normal(size=(5, DIM))):
+        assert_same_results(index.search(query, 10), brute_force(documents, query, 10))
+
+def test_compaction_survives_reopening(tmp_path):
+    rng = np.random.default_rng(1)
+    documents = make_documents(normalized(rng.normal(size=(200, DIM))), 20)
+    index = VectorIndex(str(tmp_path), MODEL)
+    index.add(documents)
+    first_segment = next(iter(index.segments))
+
+    # Deleting more than COMPACT_DELETED_SHARE of the rows rewrites the segment
+    removed = [doc_id for doc_id, _, _, _ in documents[:4]]
+    assert index.remove(removed) == removed
+    assert first_segment not in index.segments
+    assert not os.path.exists(os.path.join(str(tmp_path), first_segment + ".npy"))
+
+    remaining = documents[4:]
+    reopened = VectorIndex(str(tmp_path), MODEL)
+    assert len(reopened) == 120
+    assert sorted(reopened.documents()) == sorted(doc_id for doc_id, _, _, _ in remaining)
+    for query in normalized(rng.normal(size=(5, DIM))):
+        assert_same_results(reopened.search(query, 10), brute_force(remaining, query, 10))
+
+def test_interrupted_compaction_leaves_an_index_that_opens(tmp_path, monkeypatch):
+    rng = np.random.default_rng(2)
+    documents = make_documents(normalized(rng.normal(size=(100, DIM))), 10)
+    index = VectorIndex(str(tmp_path), MODEL)
+    index.add(documents)
+
+    def interrupted(segment):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(vector_index.Segment, "remove_files", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        index.remove(["doc0", "doc1", "doc2"])
+
+    reopened = VectorIndex(str(tmp_path), MODEL)
+    assert len(reopened) == 70
+    query = normalized(rng.normal(size=(1, DIM)))[0]
+    assert_same_results(reopened.search(query, 5), brute_force(documents[3:], query, 5))
+
+def test_ivf_recall_on_clustered_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "IVF_MIN_VECTORS", 1000)
+    rng = np.random.default_rng(3)
+    centers = normalized(rng.normal(size=(40, DIM)))
+    vectors = normalized(centers[rng.integers(len(centers), size=4000)] + 0.15 * rng.normal(size=(4000, DIM)))
+    documents = make_documents(vectors, 100)
+
+    index = VectorIndex(str(tmp_path), MODEL, nprobe=8)
+    index.add(documents)
+    assert index.stats()["lists"] > 0
+
+    k = 10
+    queries = normalized(centers[rng.integers(len(centers), size=50)] + 0.15 * rng.normal(size=(50, DIM)))
+    found = 0
+    for query in queries:
+        expected = {section["row"] for _, section in brute_force(documents, query, k)}
+        found += len(expected & {section["row"] for _, section in index.search(query, k)})
+    assert found / (k * len(queries)) >= 0.9
+
+def test_empty_documents_are_recorded_by_hash(tmp_path):
+    rng = np.random.default_rng(4)
+    documents = make_documents(normalized(rng.normal(size=(40, DIM))), 20)
+    index = VectorIndex(str(tmp_path), MODEL)
+    empty = ("empty", "empty-hash", [], np.zeros((0, DIM), dtype=np.float32))
+    assert index.add(documents + [empty]) == 2
+
+    # A document that now has no sections drops the ones it was indexed with
+    assert index.add([("doc0", "doc0-changed", [], np.zeros((0, DIM), dtype=np.float32))]) == 0
+
+    reopened = VectorIndex(str(tmp_path), MODEL)
+    assert reopened.content_hash("empty") == "empty-hash"
+    assert reopened.content_hash("doc0") == "doc0-changed"
+    assert reopened.documents() == ["doc1"]
+    assert len(reopened) == 20
+
+    reopened.remove(["empty"])
+    assert reopened.content_hash("empty") is None
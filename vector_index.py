@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import threading
+import logging
+
+import numpy as np
+
+from file_cache import write_atomic
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+CENTROIDS_FILE = 'centroids.npy'
+IVF_MIN_VECTORS = 10000  # Smaller indexes are searched exhaustively
+IVF_TRAIN_ITERATIONS = 10
+IVF_TRAIN_SAMPLE_PER_LIST = 64  # Vectors sampled per inverted list when training
+IVF_RETRAIN_GROWTH = 4  # Retrain once the index has grown this many times since training
+COMPACT_DELETED_SHARE = 0.25  # Segments are rewritten once this share of rows is deleted
+ASSIGN_CHUNK_ROWS = 65536
+
+def spherical_kmeans(vectors, k, iterations=IVF_TRAIN_ITERATIONS, seed=0):
+    """Cluster normalized vectors into k unit-length centroids by cosine similarity"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_lists(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        lists, starts = np.unique(assignments[order], return_index=True)
+        # Empty lists keep their previous centroid
+        centroids[lists] = np.add.reduceat(vectors[order], starts, axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.maximum(norms, 1e-12)
+
+    return centroids
+
+def assign_lists(vectors, centroids):
+    """Index of the nearest centroid for each vector, computed in chunks to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK_ROWS], dtype=np.float32)
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+class Segment:
+    """An immutable block of section vectors (<name>.npy), sections (<name>.json) and inverted lists written by one add call"""
+
+    def __init__(self, index_dir, name, start_row):
+        self.index_dir = index_dir
+        self.name = name
+        self.start_row = start_row
+        self.vectors = np.load(self._path('.npy'), mmap_mode='r')
+        self.alive = np.zeros(len(self.vectors), dtype=bool)
+        self.sections = None  # Loaded on first access
+        self.list_order = None
+        self.list_starts = None
+        if os.path.exists(self._path('.lists.npy')):
+            self.set_lists(np.load(self._path('.lists.npy')))
+
+    @classmethod
+    def write(cls, index_dir, name, start_row, sections, vectors):
+        """Write a new segment to disk and open it"""
+        segment_path = os.path.join(index_dir, name)
+        write_atomic(segment_path + '.json', lambda f: f.write(json.dumps(sections).encode('utf-8')))
+        write_atomic(segment_path + '.npy', lambda f: np.save(f, np.asarray(vectors, dtype=np.float32)))
+        return cls(index_dir, name, start_row)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def get_sections(self):
+        if self.sections is None:
+            with open(self._path('.json'), 'r') as f:
+                self.sections = json.load(f)
+        return self.sections
+
+    def assign(self, centroids):
+        """Assign every row to its nearest centroid and persist the inverted lists"""
+        assignments = assign_lists(self.vectors, centroids)
+        write_atomic(self._path('.lists.npy'), lambda f: np.save(f, assignments))
+        self.set_lists(assignments)
+
+    def set_lists(self, assignments):
+        # Rows grouped by list, with list l occupying list_order[list_starts[l]:list_starts[l + 1]]
+        self.list_order = np.argsort(assignments, kind="stable").astype(np.int32)
+        self.list_starts = np.searchsorted(assignments[self.list_order], np.arange(assignments.max(initial=0) + 2))
+
+    def candidates(self, lists):
+        """Local rows in the given inverted lists, or every row if the segment is not assigned"""
+        if self.list_order is None:
+            return np.arange(len(self.vectors))
+        lists = lists[lists < len(self.list_starts) - 1]
+        return np.concatenate([self.list_order[self.list_starts[l]:self.list_starts[l + 1]] for l in lists] or
+                              [np.empty(0, dtype=np.int32)])
+
+    def remove_files(self):
+        for suffix in ('.npy', '.json', '.lists.npy'):
+            try:
+                os.remove(self._path(suffix))
+            except FileNotFoundError:
+                pass
+
+    def _path(self, suffix):
+        return os.path.join(self.index_dir, self.name + suffix)
+
+class VectorIndex:
+    """Persistent index of section embeddings across a library of PDFs, searched exhaustively or through IVF lists"""
+
+    def __init__(self, index_dir, model_name, backend='numpy', nprobe=8):
+        self.index_dir = index_dir
+        self.model_name = model_name
+        self.nprobe = nprobe
+        self.lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.backend = backend
+        if backend == 'faiss':
+            try:
+                import faiss  # noqa: F401
+            except ImportError:
+                logger.warning("faiss is not installed; using the NumPy index")
+                self.backend = 'numpy'
+        self.faiss_index = None
+
+        self.meta = self._load_meta()
+        if self.meta["model"] != model_name:
+            raise ValueError(f"Index at {index_dir} was built with model {self.meta['model']}, not {model_name}")
+
+        self.centroids = None
+        if os.path.exists(os.path.join(index_dir, CENTROIDS_FILE)):
+            self.centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+        self.segments = {name: Segment(index_dir, name, info["start_row"]) for name, info in self.meta["segments"].items()}
+        for document in self.meta["documents"].values():
+            self.segments[document["segment"]].alive[document["rows"][0]:document["rows"][1]] = True
+
+    def __len__(self):
+        return sum(int(segment.alive.sum()) for segment in self.segments.values())
+
+    def __contains__(self, doc_id):
+        return doc_id in self.meta["documents"]
+
+    def content_hash(self, doc_id):
+        """Content hash a document was indexed with, or None if it is not indexed"""
+        document = self.meta["documents"].get(doc_id)
+        return document["hash"] if document else self.meta["empty"].get(doc_id)
+
+    def documents(self):
+        return list(self.meta["documents"])
+
+    def add(self, documents):
+        """Add or replace documents given as (doc_id, content_hash, sections, embeddings), returning how many have sections"""
+        # Documents without sections only have their hash recorded, so they are not parsed again until they change
+        if not documents:
+            return 0
+
+        with self.lock:
+            # Replaced documents are deleted first
+            self._remove([doc_id for doc_id, _, _, _ in documents])
+            for doc_id, content_hash, sections, _ in documents:
+                if not len(sections):
+                    self.meta["empty"][doc_id] = content_hash
+            documents = [document for document in documents if len(document[2])]
+            stale = self._compact()
+            if documents:
+                self._add(documents)
+            self.faiss_index = None
+            self._save_meta()
+            self._remove_segment_files(stale)
+            return len(documents)
+
+    def remove(self, doc_ids):
+        """Delete documents from the index"""
+        with self.lock:
+            removed = self._remove(doc_ids)
+            stale = self._compact()
+            self.faiss_index = None
+            self._save_meta()
+            self._remove_segment_files(stale)
+            return removed
+
+    def search(self, query, k):
+        """Return (similarity, section) for the k sections most similar to a normalized query vector"""
+        with self.lock:
+            query = np.asarray(query, dtype=np.float32)
+            if self.backend == 'faiss':
+                rows, scores = self._search_faiss(query, k)
+            else:
+                rows, scores = self._search_numpy(query, k)
+
+            # Best first, earlier rows winning ties
+            order = sorted(range(len(rows)), key=lambda i: (-scores[i], rows[i]))
+            return [(float(scores[i]), self._section(rows[i])) for i in order]
+
+    def stats(self):
+        return {
+            "documents": len(self.meta["documents"]),
+            "sections": len(self),
+            "segments": len(self.segments),
+            "lists": 0 if self.centroids is None else len(self.centroids),
+            "backend": self.backend
+        }
+
+    def _probe_lists(self, query):
+        if self.centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self.centroids))
+        return np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+    def _search_numpy(self, query, k):
+        lists = self._probe_lists(query)
+        rows = []
+        scores = []
+        for segment in self.segments.values():
+            local_rows = segment.candidates(lists) if lists is not None else np.arange(len(segment))
+            local_rows = np.sort(local_rows[segment.alive[local_rows]])
+            if not len(local_rows):
+                continue
+            segment_scores = segment.vectors[local_rows] @ query
+            if len(segment_scores) > k:
+                top = np.argpartition(-segment_scores, k - 1)[:k]
+                local_rows, segment_scores = local_rows[top], segment_scores[top]
+            rows.append(local_rows + segment.start_row)
+            scores.append(segment_scores)
+
+        if not rows:
+            return [], []
+        rows = np.concatenate(rows)
+        scores = np.concatenate(scores)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        return rows.tolist(), scores.tolist()
+
+    def _search_faiss(self, query, k):
+        import faiss
+
+        if self.faiss_index is None:
+            self.faiss_index = self._build_faiss(faiss)
+        if self.faiss_index.ntotal == 0:
+            return [], []
+        if self.centroids is not None:
+            self.faiss_index.nprobe = min(self.nprobe, len(self.centroids))
+
+        scores, rows = self.faiss_index.search(query.reshape(1, -1), k)
+        found = rows[0] >= 0
+        return rows[0][found].tolist(), scores[0][found].tolist()
+
+    def _build_faiss(self, faiss):
+        """Build a FAISS index over the live rows, reusing the trained IVF centroids"""
+        dim = self.meta["dim"]
+        if self.centroids is None:
+            index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            quantizer.add(self.centroids)
+            index = faiss.IndexIVFFlat(quantizer, dim, len(self.centroids), faiss.METRIC_INNER_PRODUCT)
+            index.is_trained = True
+
+        for segment in self.segments.values():
+            local_rows = np.flatnonzero(segment.alive)
+            if len(local_rows):
+                index.add_with_ids(np.ascontiguousarray(segment.vectors[local_rows]),
+                                   (local_rows + segment.start_row).astype(np.int64))
+        return index
+
+    def _section(self, row):
+        for segment in self.segments.values():
+            if segment.start_row <= row < segment.start_row + len(segment):
+                return segment.get_sections()[row - segment.start_row]
+        raise KeyError(row)
+
+    def _add(self, documents):
+        """Write documents into a new segment, training or assigning inverted lists as needed"""
+        name = f"segment_{self.meta['next_segment']:06d}"
+        self.meta["next_segment"] += 1
+        sections = []
+        for doc_id, content_hash, doc_sections, _ in documents:
+            self.meta["documents"][doc_id] = {
+                "hash": content_hash,
+                "segment": name,
+                "rows": [len(sections), len(sections) + len(doc_sections)]
+            }
+            sections.extend(doc_sections)
+        vectors = np.concatenate([np.asarray(embeddings, dtype=np.float32) for _, _, _, embeddings in documents])
+
+        segment = Segment.write(self.index_dir, name, self.meta["next_row"], sections, vectors)
+        segment.alive[:] = True
+        self.segments[name] = segment
+        self.meta["segments"][name] = {"start_row": self.meta["next_row"], "rows": len(segment)}
+        self.meta["next_row"] += len(segment)
+
+        if self._needs_training():
+            self._train()
+        elif self.centroids is not None:
+            segment.assign(self.centroids)
+
+        logger.info(f"Indexed {len(documents)} documents ({len(segment)} sections) into {name}")
+
+    def _remove(self, doc_ids):
+        removed = []
+        for doc_id in doc_ids:
+            self.meta["empty"].pop(doc_id, None)
+            document = self.meta["documents"].pop(doc_id, None)
+            if document is None:
+                continue
+            segment = self.segments[document["segment"]]
+            segment.alive[document["rows"][0]:document["rows"][1]] = False
+            removed.append(doc_id)
+        return removed
+
+    def _compact(self):
+        """Rewrite the live rows of segments that are mostly deleted into one new segment, returning the replaced ones"""
+        # Their files are deleted only after the metadata is saved, so an interrupted compaction leaves an index that opens
+        stale = [segment for segment in self.segments.values()
+                 if (~segment.alive).sum() > COMPACT_DELETED_SHARE * len(segment)]
+        if not stale:
+            return []
+
+        documents = []
+        stale_names = {segment.name for segment in stale}
+        for doc_id, document in list(self.meta["documents"].items()):
+            if document["segment"] in stale_names:
+                segment = self.segments[document["segment"]]
+                start, end = document["rows"]
+                documents.append((doc_id, document["hash"], segment.get_sections()[start:end],
+                                  np.asarray(segment.vectors[start:end])))
+
+        for segment in stale:
+            del self.segments[segment.name]
+            del self.meta["segments"][segment.name]
+        for doc_id, _, _, _ in documents:
+            del self.meta["documents"][doc_id]
+
+        logger.info(f"Compacting {len(stale)} segments")
+        if documents:
+            self._add(documents)
+        return stale
+
+    def _remove_segment_files(self, segments):
+        for segment in segments:
+            segment.remove_files()
+
+    def _needs_training(self):
+        live = len(self)
+        if live < IVF_MIN_VECTORS:
+            return False
+        return self.centroids is None or live > IVF_RETRAIN_GROWTH * self.meta["trained_rows"]
+
+    def _train(self):
+        """Train IVF centroids on a sample of live vectors and reassign every segment"""
+        live = [np.asarray(segment.vectors[segment.alive]) for segment in self.segments.values()]
+        vectors = np.concatenate(live)
+        num_lists = max(1, int(np.sqrt(len(vectors))))
+        sample_size = min(len(vectors), num_lists * IVF_TRAIN_SAMPLE_PER_LIST)
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+
+        logger.info(f"Training IVF index with {num_lists} lists on {sample_size} vectors")
+        self.centroids = spherical_kmeans(sample, num_lists)
+        write_atomic(os.path.join(self.index_dir, CENTROIDS_FILE), lambda f: np.save(f, self.centroids))
+        for segment in self.segments.values():
+            segment.assign(self.centroids)
+        self.meta["trained_rows"] = len(vectors)
+
+    def _load_meta(self):
+        try:
+            with open(os.path.join(self.index_dir, INDEX_FILE), 'r') as f:
+                meta = json.load(f)
+            meta.setdefault("empty", {})  # Indexes written before empty documents were recorded
+            return meta
+        except (OSError, ValueError):
+            return {
+                "model": self.model_name,
+                "dim": None,
+                "next_segment": 0,
+                "next_row": 0,
+                "trained_rows": 0,
+                "segments": {},
+                "documents": {},
+                "empty": {}  # doc_id -> content hash of documents without sections
+            }
+
+    def _save_meta(self):
+        if self.meta["dim"] is None and self.segments:
+            self.meta["dim"] = next(iter(self.segments.values())).vectors.shape[1]
+        write_atomic(os.path.join(self.index_dir, INDEX_FILE),
+                     lambda f: f.write(json.dumps(self.meta).encode('utf-8')))